@@ -3,20 +3,121 @@
 Script Python para extrair arquivos appsettings.json de servidores Windows via SSM
 Autor: AWS Terraform EC2 CodeDeploy Project
 Data: 2025-08-15
+
+Também pode ser usado como biblioteca:
+
+    extractor = AppSettingsExtractor(aws_profile='meu-profile', configure_logging=False)
+    for result in extractor.iter_results():
+        print(result.instance.name, result.status, list(result.files))
 """
 
+import asyncio
+import base64
 import boto3
+import cProfile
+import gzip
+import hashlib
 import json
 import os
+import pstats
+import re
+import socket
 import sys
+import threading
 import time
-from datetime import datetime
+from abc import ABC, abstractmethod
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import List, Dict, Optional, Tuple
+from typing import Any, AsyncIterator, Iterable, Iterator, List, Dict, Optional, Tuple
 import argparse
 import logging
-from dataclasses import dataclass
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+
+# Sem handlers por padrão quando usado como biblioteca (o CLI configura os seus)
+logging.getLogger('AppSettingsExtractor').addHandler(logging.NullHandler())
+
+# Arquivos extraídos de cada diretório ({hostname} = hostname da instância)
+APPSETTINGS_PATTERNS = ['appsettings.json', 'appsettings.{hostname}.json']
+
+# Documento SSM próprio do extrator (lógica remota em ssm_document/extractor_remote.ps1)
+SSM_DOCUMENT_NAME = 'AppSettingsExtractor-Remote'
+SSM_DOCUMENT_SCRIPT = Path(__file__).resolve().parent / 'ssm_document' / 'extractor_remote.ps1'
+
+# Parâmetros são interpolados no script: bloquear aspas e caracteres de expressão
+_SSM_PARAMETER_PATTERN = "^[^'\"`$;\\r\\n]*$"
+
+
+def ssm_document_commands(parameters: Dict[str, List[str]]) -> List[str]:
+    """Comandos do documento com os parâmetros já substituídos (fallback inline)"""
+    document = build_ssm_document()
+    values = {name: spec.get('default', '') for name, spec in document['parameters'].items()}
+    values.update({name: value[0] for name, value in parameters.items()})
+    
+    return [
+        re.sub(r'\{\{ (\w+) \}\}', lambda match: values.get(match.group(1), ''), line)
+        for line in document['mainSteps'][0]['inputs']['runCommand']
+    ]
+
+
+def build_ssm_document() -> Dict[str, Any]:
+    """Monta o conteúdo (schema 2.2) do documento SSM a partir do script remoto"""
+    script = SSM_DOCUMENT_SCRIPT.read_text(encoding='utf-8').splitlines()
+    
+    return {
+        'schemaVersion': '2.2',
+        'description': 'Extrai arquivos appsettings.json e descobre sites IIS',
+        'parameters': {
+            'mode': {
+                'type': 'String',
+                'description': 'Operação remota',
+                'allowedValues': ['discover-sites', 'get-content', 'read-file', 'put-content']
+            },
+            'path': {
+                'type': 'String',
+                'description': 'Diretório (get-content) ou arquivo (read-file/put-content)',
+                'default': '',
+                'allowedPattern': _SSM_PARAMETER_PATTERN
+            },
+            'patterns': {
+                'type': 'String',
+                'description': 'Nomes de arquivo separados por vírgula ({hostname} é expandido)',
+                'default': 'appsettings.json',
+                'allowedPattern': _SSM_PARAMETER_PATTERN
+            },
+            'content': {
+                'type': 'String',
+                'description': 'Conteúdo gzip+base64 a gravar (modo put-content)',
+                'default': '',
+                'allowedPattern': '^[A-Za-z0-9+/=]*$'
+            },
+            'sha256': {
+                'type': 'String',
+                'description': 'Hash esperado do arquivo gravado (modo put-content)',
+                'default': '',
+                'allowedPattern': '^[0-9a-fA-F]*$'
+            },
+            'chunk': {
+                'type': 'String',
+                'description': 'Página do arquivo a devolver (modo read-file)',
+                'default': '0',
+                'allowedPattern': '^[0-9]+$'
+            }
+        },
+        'mainSteps': [{
+            'action': 'aws:runPowerShellScript',
+            'name': 'extractAppSettings',
+            'inputs': {
+                # O script roda como scriptblock para receber os parâmetros do documento
+                'runCommand': ['& {'] + script + [
+                    "} -Mode '{{ mode }}' -Path '{{ path }}' -Patterns '{{ patterns }}' "
+                    "-Content '{{ content }}' -Sha256 '{{ sha256 }}' -Chunk '{{ chunk }}'"
+                ]
+            }
+        }]
+    }
 
 
 @dataclass
@@ -28,6 +129,718 @@ class WindowsInstance:
     public_ip: str
     hostname: Optional[str] = None
     ssm_status: Optional[str] = None
+    sites: Optional[Dict[str, str]] = None
+    remote_paths: Dict[str, str] = field(default_factory=dict)
+    raw_files: Dict[str, bytes] = field(default_factory=dict, repr=False)
+
+
+@dataclass
+class ExtractionResult:
+    """Resultado da extração de uma instância"""
+    instance: WindowsInstance
+    status: str  # success | failed | cancelled | not_started
+    files: Dict[str, str] = field(default_factory=dict)
+    error: Optional[str] = None
+    duration_seconds: float = 0.0
+    # Bytes originais dos arquivos lidos via read-file (files tem o texto decodificado)
+    raw: Dict[str, bytes] = field(default_factory=dict, repr=False)
+    
+    def __post_init__(self):
+        if not self.raw:
+            self.raw = {name: self.instance.raw_files[name] for name in self.files
+                        if name in self.instance.raw_files}
+    
+    @property
+    def success(self) -> bool:
+        return self.status == 'success'
+
+
+class ExtractorError(Exception):
+    """Erro do extrator que impede a execução"""
+
+
+class AwsCredentialsError(ExtractorError):
+    """Falha ao inicializar os clientes ou validar as credenciais AWS"""
+
+
+class ResultSink(ABC):
+    """Destino dos resultados de extração; subclasses implementam write()"""
+    
+    @abstractmethod
+    def write(self, result: ExtractionResult):
+        """Recebe cada resultado antes de ele ser produzido por iter_results()"""
+
+
+class BackupDirectorySink(ResultSink):
+    """Salva os arquivos de cada instância em config_backups_<timestamp>/<instância>"""
+    
+    def __init__(self, extractor: 'AppSettingsExtractor'):
+        self.extractor = extractor
+    
+    def write(self, result: ExtractionResult):
+        # Salva também resultados cancelados, para não perder o que já foi extraído
+        files_saved = self.extractor.save_files(result.instance, result.files, result.raw)
+        
+        if result.success and files_saved == 0:
+            result.status = 'failed'
+            result.error = 'Falha ao salvar arquivos'
+            self.extractor.logger.error(f"❌ Falha ao salvar arquivos de {result.instance.name}")
+        elif result.success:
+            self.extractor.logger.info(f"✅ Concluído: {result.instance.name} - "
+                                       f"{files_saved} arquivos salvos")
+
+
+class SiteInventory:
+    """Cache persistente dos sites IIS descobertos por instância"""
+    
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._data = self._load()
+        self._updated: set = set()
+    
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        """Lê o inventário do disco (vazio se inexistente ou corrompido)"""
+        if not self.path.exists():
+            return {}
+        try:
+            return json.loads(self.path.read_text(encoding='utf-8')).get('instances', {})
+        except (ValueError, OSError):
+            # Inventário corrompido: será reconstruído pela descoberta
+            return {}
+    
+    def get(self, instance_id: str) -> Optional[Dict[str, Any]]:
+        """Retorna a entrada cacheada da instância (hostname e sites)"""
+        with self._lock:
+            entry = self._data.get(instance_id)
+            return dict(entry) if entry else None
+    
+    def update(self, instance: WindowsInstance):
+        """Atualiza a entrada da instância com o resultado da descoberta"""
+        with self._lock:
+            self._data[instance.instance_id] = {
+                'instance_name': instance.name,
+                'hostname': instance.hostname,
+                'sites': instance.sites,
+                'discovered_at': datetime.now().isoformat()
+            }
+            self._updated.add(instance.instance_id)
+    
+    @contextmanager
+    def _file_lock(self, stale_seconds: float = 60):
+        """Lock entre processos/hosts (arquivo criado com O_EXCL ao lado do inventário)"""
+        lock_path = self.path.with_name(f'{self.path.name}.lock')
+        while True:
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                # Lock abandonado por um processo que morreu: remover e tentar de novo
+                try:
+                    if time.time() - lock_path.stat().st_mtime > stale_seconds:
+                        lock_path.unlink()
+                        continue
+                except FileNotFoundError:
+                    continue
+                time.sleep(0.05)
+        
+        try:
+            os.close(fd)
+            yield
+        finally:
+            try:
+                lock_path.unlink()
+            except FileNotFoundError:
+                pass
+    
+    def save(self):
+        """Grava o inventário em disco, preservando entradas gravadas por outros processos"""
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            
+            # Ler-mesclar-substituir sob lock: sem ele, dois shards perdem as entradas um do outro
+            with self._file_lock():
+                data = self._load()
+                data.update({instance_id: self._data[instance_id] for instance_id in self._updated})
+                self._data = data
+                
+                tmp_path = self.path.with_name(f'{self.path.name}.{os.getpid()}.tmp')
+                tmp_path.write_text(json.dumps({'instances': data}, indent=2, sort_keys=True),
+                                    encoding='utf-8')
+                os.replace(tmp_path, self.path)
+
+
+def shard_of(instance_id: str, shard_count: int) -> int:
+    """Shard determinístico de uma instância (hash estável do instance ID)"""
+    digest = hashlib.sha1(instance_id.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % shard_count
+
+
+# Arquivos gerados pelo extrator (não são configurações extraídas)
+_REPORT_FILES = {'metadata.json', 'run_report.json', 'validation_report.json', 'fleet.json'}
+CANONICAL_DIR = '_canonical'
+
+
+def _is_report_file(path: Path) -> bool:
+    """True para relatórios/metadados gerados pelo extrator"""
+    return path.name in _REPORT_FILES or path.name.startswith('restore_report_')
+
+
+_JSON_COMMENT = re.compile(r'"(?:\\.|[^"\\])*"|//[^\n]*|/\*.*?(?:\*/|\Z)', re.DOTALL)
+_JSON_TRAILING_COMMA = re.compile(r'"(?:\\.|[^"\\])*"|,(?=\s*[}\]])')
+
+
+def _strip_json_comments(text: str) -> Tuple[str, bool]:
+    """
+    Remove comentários // e /* */ e vírgulas finais (aceitos pelo appsettings do .NET)
+    
+    Comentários saem primeiro, para que `1, // comentário` seguido de `}` também perca
+    a vírgula. As quebras de linha dos comentários de bloco são mantidas, então a linha
+    de um erro no texto resultante é a mesma do original.
+    """
+    changed = False
+    
+    def replace(match):
+        nonlocal changed
+        token = match.group(0)
+        if token.startswith('"'):
+            return token
+        changed = True
+        return '\n' * token.count('\n') if token.startswith('/*') else ''
+    
+    text = _JSON_COMMENT.sub(replace, text)
+    return _JSON_TRAILING_COMMA.sub(replace, text), changed
+
+
+def _decode_remote_file(raw: bytes) -> str:
+    """Texto de um arquivo lido do servidor (BOM UTF-8 preservado como caractere)"""
+    for bom, encoding in ((b'\xff\xfe', 'utf-16-le'), (b'\xfe\xff', 'utf-16-be')):
+        if raw.startswith(bom):
+            return raw[len(bom):].decode(encoding, errors='replace')
+    
+    try:
+        return raw.decode('utf-8')
+    except UnicodeDecodeError:
+        return raw.decode('cp1252', errors='replace')
+
+
+def normalize_config(raw: bytes) -> Dict[str, Any]:
+    """
+    Decodifica, valida e canonicaliza um arquivo de configuração JSON
+    
+    A forma canônica tem chaves ordenadas, indentação de 2 espaços, finais de linha
+    LF e nenhum BOM, então o sha256 dela identifica conteúdo equivalente.
+    """
+    info: Dict[str, Any] = {
+        'size': len(raw),
+        'bom': False,
+        'encoding': 'utf-8',
+        'crlf': b'\r\n' in raw,
+        'trailing_whitespace': False,
+        'comments': False,
+        'duplicate_keys': [],
+        'status': 'valid',
+        'error': None,
+        'canonical': None,
+        'sha256': None
+    }
+    
+    # 1. Decodificar (BOM UTF-8/UTF-16, senão UTF-8 e por fim cp1252)
+    for bom, encoding in ((b'\xef\xbb\xbf', 'utf-8'), (b'\xff\xfe', 'utf-16-le'),
+                          (b'\xfe\xff', 'utf-16-be')):
+        if raw.startswith(bom):
+            info['bom'] = True
+            info['encoding'] = encoding
+            raw = raw[len(bom):]
+            break
+    
+    try:
+        text = raw.decode(info['encoding'])
+    except UnicodeDecodeError:
+        info['encoding'] = 'cp1252'
+        text = raw.decode('cp1252', errors='replace')
+    
+    # BOM que sobreviveu como caractere (conteúdo vindo do SSM)
+    if text.startswith('\ufeff'):
+        info['bom'] = True
+        text = text[1:]
+    
+    lines = text.replace('\r\n', '\n').split('\n')
+    info['trailing_whitespace'] = any(line != line.rstrip() for line in lines)
+    text = text.strip()
+    
+    # 2. Parse (detectando chaves duplicadas)
+    def collect_pairs(pairs):
+        keys = [key for key, _ in pairs]
+        info['duplicate_keys'].extend(sorted({key for key in keys if keys.count(key) > 1}))
+        return dict(pairs)
+    
+    try:
+        try:
+            data = json.loads(text, object_pairs_hook=collect_pairs)
+        except json.JSONDecodeError:
+            stripped, info['comments'] = _strip_json_comments(text)
+            if not info['comments']:
+                raise
+            info['duplicate_keys'] = []
+            data = json.loads(stripped, object_pairs_hook=collect_pairs)
+    except json.JSONDecodeError as e:
+        # Fim inesperado do texto efetivamente analisado (e.doc) = conteúdo truncado
+        truncated = e.pos >= len(e.doc.rstrip())
+        info['status'] = 'truncated' if truncated else 'invalid'
+        info['error'] = f"{e.msg} (linha {e.lineno}, coluna {e.colno})"
+        return info
+    
+    # 3. Canonicalizar
+    canonical = json.dumps(data, indent=2, sort_keys=True, ensure_ascii=False) + '\n'
+    info['canonical'] = canonical
+    info['sha256'] = hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+    return info
+
+
+def _validate_config_file(source: str, canonical_path: str) -> Dict[str, Any]:
+    """Valida um arquivo e grava sua forma canônica (executado no pool de processos)"""
+    info = normalize_config(Path(source).read_bytes())
+    canonical = info.pop('canonical')
+    
+    if canonical is not None:
+        target = Path(canonical_path)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_bytes(canonical.encode('utf-8'))
+    
+    return info
+
+
+def validate_snapshot(snapshot_dir: Path, workers: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Valida e normaliza em paralelo todos os arquivos extraídos de um snapshot
+    
+    As formas canônicas vão para <snapshot>/_canonical/ e o resultado para
+    <snapshot>/validation_report.json.
+    """
+    sources = sorted(
+        path for path in snapshot_dir.rglob('*.json')
+        if not _is_report_file(path)
+        and CANONICAL_DIR not in path.relative_to(snapshot_dir).parts
+    )
+    canonical_dir = snapshot_dir / CANONICAL_DIR
+    targets = [str(canonical_dir / path.relative_to(snapshot_dir)) for path in sources]
+    
+    workers = workers or os.cpu_count() or 1
+    if len(sources) < 2 or workers == 1:
+        infos = [_validate_config_file(str(src), dst) for src, dst in zip(sources, targets)]
+    else:
+        chunksize = max(1, len(sources) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            infos = list(executor.map(_validate_config_file, map(str, sources), targets,
+                                      chunksize=chunksize))
+    
+    files = {}
+    by_hash: Dict[str, List[str]] = {}
+    summary = {'valid': 0, 'invalid': 0, 'truncated': 0}
+    
+    for source, info in zip(sources, infos):
+        relative = source.relative_to(snapshot_dir).as_posix()
+        files[relative] = info
+        summary[info['status']] += 1
+        if info['sha256']:
+            by_hash.setdefault(info['sha256'], []).append(relative)
+    
+    report = {
+        'snapshot': str(snapshot_dir),
+        'validation_date': datetime.now().isoformat(),
+        'files_total': len(sources),
+        'summary': summary,
+        'unique_contents': len(by_hash),
+        'duplicates': {digest: names for digest, names in by_hash.items() if len(names) > 1},
+        'files': files
+    }
+    
+    snapshot_dir.mkdir(parents=True, exist_ok=True)
+    (snapshot_dir / 'validation_report.json').write_text(json.dumps(report, indent=2),
+                                                         encoding='utf-8')
+    return report
+
+
+@dataclass
+class RestoreTarget:
+    """Arquivo de um snapshot a ser restaurado numa instância"""
+    instance_id: str
+    instance_name: str
+    remote_path: str
+    local_file: Path
+    sha256: str
+    status: str = 'pending'  # pending | success | failed | skipped
+    error: Optional[str] = None
+
+
+def load_restore_targets(snapshot_dir: Path) -> Tuple[List[RestoreTarget], List[str]]:
+    """
+    Lê os metadata.json de um snapshot e monta os arquivos a restaurar
+    
+    Cada arquivo é validado (normalize_config) antes de entrar no restore, mesmo sem
+    validation_report.json: inválidos/truncados (ex: cortados no limite de saída do
+    SSM) não são restaurados. Retorna (alvos, avisos).
+    """
+    warnings = []
+    invalid = set()
+    
+    report_path = snapshot_dir / 'validation_report.json'
+    if report_path.exists():
+        report = json.loads(report_path.read_text(encoding='utf-8'))
+        invalid = {name for name, info in report['files'].items() if info['status'] != 'valid'}
+    
+    targets = []
+    for metadata_path in sorted(snapshot_dir.rglob('metadata.json')):
+        if CANONICAL_DIR in metadata_path.relative_to(snapshot_dir).parts:
+            continue
+        
+        metadata = json.loads(metadata_path.read_text(encoding='utf-8'))
+        instance_dir = metadata_path.parent
+        remote_paths = metadata.get('remote_paths') or {}
+        
+        for name in metadata.get('files_extracted', []):
+            local_file = instance_dir / name
+            relative = local_file.relative_to(snapshot_dir).as_posix()
+            
+            # Snapshots antigos não têm remote_paths: usar target_path
+            remote_path = remote_paths.get(name)
+            if not remote_path and metadata.get('target_path'):
+                remote_path = f"{metadata['target_path']}\\{name}"
+            
+            if not remote_path:
+                warnings.append(f"{relative}: caminho remoto desconhecido")
+            elif not local_file.exists():
+                warnings.append(f"{relative}: arquivo ausente no snapshot")
+            elif relative in invalid:
+                warnings.append(f"{relative}: inválido no validation_report.json")
+            else:
+                raw = local_file.read_bytes()
+                validation = normalize_config(raw)
+                if validation['status'] != 'valid':
+                    warnings.append(f"{relative}: JSON {validation['status']} ({validation['error']})")
+                    continue
+                
+                targets.append(RestoreTarget(
+                    instance_id=metadata['instance_id'],
+                    instance_name=metadata['instance_name'],
+                    remote_path=remote_path,
+                    local_file=local_file,
+                    sha256=hashlib.sha256(raw).hexdigest()
+                ))
+    
+    return targets, warnings
+
+
+def _error_budget(max_errors: str, total: int) -> int:
+    """Converte MaxErrors do SSM ('3' ou '10%') em número de erros tolerados"""
+    if max_errors.endswith('%'):
+        return int(total * float(max_errors[:-1]) / 100)
+    return int(max_errors)
+
+
+class ShardCoordinator:
+    """Distribui shards entre processos/hosts com leases em arquivo num diretório compartilhado"""
+    
+    def __init__(self, shared_dir: Path, shard_count: int, lease_seconds: float = 300):
+        self.shared_dir = shared_dir
+        self.shard_count = shard_count
+        self.lease_seconds = lease_seconds
+        self.owner = f'{socket.gethostname()}:{os.getpid()}'
+        
+        self.shared_dir.mkdir(parents=True, exist_ok=True)
+    
+    def shard_dir(self, index: int) -> Path:
+        """Diretório de saída do shard"""
+        return self.shared_dir / f'shard-{index:03d}'
+    
+    def _lease_path(self, index: int) -> Path:
+        return self.shared_dir / f'shard-{index:03d}.lease'
+    
+    def _done_path(self, index: int) -> Path:
+        return self.shared_dir / f'shard-{index:03d}.done'
+    
+    def _is_stale(self, path: Path) -> bool:
+        try:
+            return time.time() - path.stat().st_mtime > self.lease_seconds
+        except FileNotFoundError:
+            return True
+    
+    @staticmethod
+    def _remove(path: Path):
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+    
+    def claim(self) -> Optional[int]:
+        """Reivindica o próximo shard livre (ou com lease expirado); None se não restar nenhum"""
+        for index in range(self.shard_count):
+            if self._done_path(index).exists():
+                continue
+            if self._try_acquire(index):
+                return index
+        return None
+    
+    def _try_acquire(self, index: int) -> bool:
+        """Cria o lease de forma atômica (O_EXCL), assumindo leases expirados"""
+        lease = self._lease_path(index)
+        
+        try:
+            fd = os.open(lease, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if not self._is_stale(lease):
+                return False
+            
+            # Lease expirado: só um processo consegue renomeá-lo
+            stale = lease.with_name(f'{lease.name}.{self.owner.replace(":", "_")}.stale')
+            try:
+                os.rename(lease, stale)
+            except OSError:
+                return False
+            
+            if not self._is_stale(stale):
+                # Outro processo renovou o lease nesse meio tempo: devolver
+                try:
+                    os.link(stale, lease)
+                except OSError:
+                    pass
+                self._remove(stale)
+                return False
+            
+            self._remove(stale)
+            try:
+                fd = os.open(lease, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                return False
+        
+        with os.fdopen(fd, 'w', encoding='utf-8') as lease_file:
+            json.dump({'owner': self.owner, 'claimed_at': datetime.now().isoformat()}, lease_file)
+        return True
+    
+    @contextmanager
+    def heartbeat(self, index: int):
+        """Renova o lease periodicamente enquanto o shard é processado"""
+        lease = self._lease_path(index)
+        stop = threading.Event()
+        
+        def renew():
+            while not stop.wait(self.lease_seconds / 3):
+                try:
+                    os.utime(lease)
+                except OSError:
+                    pass
+        
+        thread = threading.Thread(target=renew, name=f'lease-shard-{index:03d}', daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+    
+    def complete(self, index: int):
+        """Marca o shard como concluído e libera o lease"""
+        self._done_path(index).write_text(
+            json.dumps({'owner': self.owner, 'completed_at': datetime.now().isoformat()}),
+            encoding='utf-8'
+        )
+        self.release(index)
+    
+    def release(self, index: int):
+        """Libera o lease sem concluir (o shard poderá ser reivindicado de novo)"""
+        self._remove(self._lease_path(index))
+    
+    def pending(self) -> List[int]:
+        """Shards ainda sem .done (em andamento em algum host ou não reivindicados)"""
+        return [index for index in range(self.shard_count) if not self._done_path(index).exists()]
+    
+    def claim_merge(self) -> bool:
+        """Reserva a consolidação automática (O_EXCL): só o primeiro host a chegar consolida"""
+        try:
+            fd = os.open(self.shared_dir / 'merge.claim', os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w', encoding='utf-8') as claim_file:
+            json.dump({'owner': self.owner, 'claimed_at': datetime.now().isoformat()}, claim_file)
+        return True
+
+
+class CancellationToken:
+    """Prazo global da execução e cancelamento cooperativo entre as etapas"""
+    
+    def __init__(self, deadline_seconds: Optional[float] = None,
+                 parent: Optional['CancellationToken'] = None):
+        self._event = threading.Event()
+        self._deadline = time.monotonic() + deadline_seconds if deadline_seconds else None
+        self._parent = parent
+        self.reason: Optional[str] = None
+    
+    def child(self) -> 'CancellationToken':
+        """Token de uma iteração: cancelado junto com este (inclusive pelo prazo), não o contrário"""
+        return CancellationToken(parent=self)
+    
+    def cancel(self, reason: str):
+        """Cancela a execução (a primeira razão informada é mantida)"""
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+    
+    @property
+    def cancelled(self) -> bool:
+        """True se a execução foi cancelada ou o prazo expirou"""
+        if not self._event.is_set() and self._parent is not None and self._parent.cancelled:
+            self.cancel(self._parent.reason)
+        if not self._event.is_set() and self._deadline is not None \
+                and time.monotonic() >= self._deadline:
+            self.cancel('deadline')
+        return self._event.is_set()
+    
+    def remaining(self) -> Optional[float]:
+        """Segundos restantes até o prazo (None = sem prazo)"""
+        remaining = self._parent.remaining() if self._parent is not None else None
+        if self._deadline is not None:
+            own = max(self._deadline - time.monotonic(), 0.0)
+            remaining = own if remaining is None else min(remaining, own)
+        return remaining
+    
+    def wait(self, seconds: float) -> bool:
+        """Aguarda até `seconds`, acordando no cancelamento; retorna True se cancelado"""
+        remaining = self.remaining()
+        if remaining is not None:
+            seconds = min(seconds, remaining)
+        self._event.wait(seconds)
+        return self.cancelled
+
+
+def _parse_ssm_timestamp(value: Any) -> Optional[float]:
+    """Converte ExecutionStart/EndDateTime do SSM (ISO 8601 ou datetime) em epoch"""
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        moment = value
+    else:
+        try:
+            # fromisoformat (< 3.11) só aceita frações com 3 ou 6 dígitos
+            text = re.sub(r'\.(\d+)', lambda m: '.' + m.group(1)[:6].ljust(6, '0'),
+                          str(value).replace('Z', '+00:00'))
+            moment = datetime.fromisoformat(text)
+        except ValueError:
+            return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+class TraceRecorder:
+    """Registra spans de execução no formato Chrome trace-event (chrome://tracing, Perfetto)"""
+    
+    def __init__(self):
+        self._events: List[Dict[str, Any]] = []
+        self._thread_names: Dict[int, str] = {}
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+        self._wall_origin = time.time()
+        self._pid = os.getpid()
+    
+    def now(self) -> float:
+        """Retorna o relógio usado pelos spans (segundos, monotônico)"""
+        return time.perf_counter()
+    
+    def from_wall_clock(self, timestamp: float) -> float:
+        """Converte um horário epoch (ex: reportado pelo SSM) para o relógio dos spans"""
+        return self._origin + (timestamp - self._wall_origin)
+    
+    def add_span(self, name: str, start: float, end: float,
+                 category: str = 'extractor', **args):
+        """Registra um span já medido (start/end obtidos via now())"""
+        thread = threading.current_thread()
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': round((start - self._origin) * 1_000_000, 3),
+            'dur': round(max(end - start, 0.0) * 1_000_000, 3),
+            'pid': self._pid,
+            'tid': thread.ident,
+            'args': args
+        }
+        
+        with self._lock:
+            self._events.append(event)
+            self._thread_names.setdefault(thread.ident, thread.name)
+    
+    @contextmanager
+    def span(self, name: str, category: str = 'extractor', **args):
+        """Context manager que mede o bloco como um span"""
+        start = self.now()
+        try:
+            yield args
+        finally:
+            self.add_span(name, start, self.now(), category, **args)
+    
+    def export(self, path: Path) -> int:
+        """Exporta os spans em JSON trace-event e retorna o número de eventos"""
+        with self._lock:
+            events = list(self._events)
+            thread_names = dict(self._thread_names)
+        
+        # Metadados para nomear as linhas do timeline por thread
+        metadata = [
+            {'name': 'thread_name', 'ph': 'M', 'pid': self._pid, 'tid': tid,
+             'args': {'name': thread_name}}
+            for tid, thread_name in thread_names.items()
+        ]
+        metadata.append({'name': 'process_name', 'ph': 'M', 'pid': self._pid,
+                         'args': {'name': 'AppSettingsExtractor'}})
+        
+        trace = {
+            'traceEvents': metadata + sorted(events, key=lambda e: e['ts']),
+            'displayTimeUnit': 'ms'
+        }
+        
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(trace), encoding='utf-8')
+        return len(events)
+
+
+class CpuProfiler:
+    """Coleta perfil de CPU (cProfile) do lado local, inclusive das threads de trabalho"""
+    
+    def __init__(self):
+        self._profiles: List[cProfile.Profile] = []
+        self._lock = threading.Lock()
+    
+    @contextmanager
+    def profile(self):
+        """Perfila o bloco na thread atual"""
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Python 3.12+: já existe um profiler ativo e ele cobre todas as threads
+            yield
+            return
+        
+        try:
+            yield
+        finally:
+            profiler.disable()
+            with self._lock:
+                self._profiles.append(profiler)
+    
+    def dump(self, path: Path) -> bool:
+        """Combina os perfis coletados e salva no formato pstats"""
+        with self._lock:
+            profiles = list(self._profiles)
+        
+        if not profiles:
+            return False
+        
+        path.parent.mkdir(parents=True, exist_ok=True)
+        stats = pstats.Stats(*profiles)
+        stats.dump_stats(str(path))
+        return True
 
 
 class ColoredFormatter(logging.Formatter):
@@ -55,7 +868,21 @@ class AppSettingsExtractor:
     def __init__(self, aws_profile: str = 'default', 
                  server_filter: str = 'SI2',
                  target_path: str = r'D:\Sites\Api',
-                 concurrent_operations: int = 3):
+                 concurrent_operations: int = 3,
+                 trace_file: Optional[str] = None,
+                 cprofile_file: Optional[str] = None,
+                 deadline_seconds: Optional[float] = None,
+                 discover_sites: bool = False,
+                 inventory_file: str = 'site_inventory.json',
+                 refresh_inventory: bool = False,
+                 backup_dir: Optional[str] = None,
+                 configure_logging: bool = True,
+                 session: Optional[boto3.Session] = None,
+                 shard_index: Optional[int] = None,
+                 shard_count: int = 1,
+                 ssm_document: Optional[str] = SSM_DOCUMENT_NAME,
+                 validate: bool = False,
+                 validate_workers: Optional[int] = None):
         """
         Inicializa o extrator
         
@@ -64,43 +891,116 @@ class AppSettingsExtractor:
             server_filter: Filtro para nome dos servidores
             target_path: Caminho no servidor Windows
             concurrent_operations: Número de operações simultâneas
+            trace_file: Arquivo de saída do trace (Chrome trace-event), se habilitado
+            cprofile_file: Arquivo de saída do cProfile (pstats), se habilitado
+            deadline_seconds: Prazo total da execução em segundos (None = sem prazo)
+            discover_sites: Descobre os sites IIS em vez de usar um único target_path
+            inventory_file: Arquivo de cache dos sites descobertos
+            refresh_inventory: Ignora o cache e refaz a descoberta
+            backup_dir: Diretório de backup (padrão: ./config_backups_<timestamp>)
+            configure_logging: Anexa handlers de console/arquivo (False para uso como biblioteca)
+            session: Sessão boto3 já configurada (padrão: criada a partir de aws_profile)
+            shard_index: Processa só as instâncias deste shard (None = todas)
+            shard_count: Número total de shards
+            ssm_document: Nome do documento SSM do extrator (None = comandos inline)
+            validate: Valida e canonicaliza os arquivos salvos ao final da extração
+            validate_workers: Processos da validação (padrão: número de CPUs)
+        
+        Raises:
+            AwsCredentialsError: Se os clientes AWS não puderem ser inicializados
         """
         self.aws_profile = aws_profile
         self.server_filter = server_filter
         self.target_path = target_path
         self.concurrent_operations = concurrent_operations
+        self.shard_index = shard_index
+        self.shard_count = shard_count
         
-        # Configurar diretórios
+        # Configurar diretórios (criados sob demanda)
         self.timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        self.backup_dir = Path(f'./config_backups_{self.timestamp}')
+        self.backup_dir = Path(backup_dir or f'./config_backups_{self.timestamp}')
         self.log_dir = Path('./logs')
         
-        # Criar diretórios
-        self.backup_dir.mkdir(parents=True, exist_ok=True)
-        self.log_dir.mkdir(exist_ok=True)
+        # Profiling (opcional)
+        self.trace_file = Path(trace_file) if trace_file else None
+        self.cprofile_file = Path(cprofile_file) if cprofile_file else None
+        self.tracer = TraceRecorder() if self.trace_file else None
+        self.cpu_profiler = CpuProfiler() if self.cprofile_file else None
+        
+        # Descoberta de sites IIS (opcional)
+        self.discover_sites = discover_sites
+        self.refresh_inventory = refresh_inventory
+        self.inventory = SiteInventory(Path(inventory_file)) if discover_sites else None
+        
+        # Validação pós-extração (opcional)
+        self.validate = validate
+        self.validate_workers = validate_workers
+        
+        # Documento SSM versionado (registrado na primeira execução)
+        self.ssm_document_name = ssm_document
+        self.ssm_document_version: Optional[str] = None
+        self._ssm_document_checked = False
+        
+        # Prazo global e cancelamento cooperativo (cada iteração da biblioteca usa um filho)
+        self.deadline_seconds = deadline_seconds
+        self._run_token = CancellationToken(deadline_seconds)
+        self._local = threading.local()
+        
+        # Comandos SSM em andamento (command_id -> (instance_id, token); None = vários alvos)
+        self._inflight_commands: Dict[str, Tuple[Optional[str], CancellationToken]] = {}
+        self._inflight_lock = threading.Lock()
         
         # Configurar logging
-        self._setup_logging()
+        self.logger = logging.getLogger('AppSettingsExtractor')
+        if configure_logging:
+            self._setup_logging()
         
         # Inicializar clientes AWS
-        self._init_aws_clients()
+        self._init_aws_clients(session)
+        
+        # Manifesto por instância (gravado no run_report.json)
+        self.manifest: List[Dict[str, Any]] = []
         
         # Estatísticas
         self.stats = {
             'instances_found': 0,
             'instances_processed': 0,
             'instances_successful': 0,
+            'instances_cancelled': 0,
+            'instances_not_started': 0,
             'files_extracted': 0,
+            'files_invalid': 0,
+            'commands_cancelled': 0,
             'errors': []
         }
     
+    @property
+    def cancel_token(self) -> CancellationToken:
+        """Token da iteração em andamento nesta thread (ou o da execução)"""
+        return getattr(self._local, 'cancel_token', None) or self._run_token
+    
+    @contextmanager
+    def _using_token(self, token: CancellationToken):
+        """Associa o token da iteração à thread atual durante o bloco"""
+        previous = getattr(self._local, 'cancel_token', None)
+        self._local.cancel_token = token
+        try:
+            yield
+        finally:
+            self._local.cancel_token = previous
+    
     def _setup_logging(self):
         """Configura logging com cores e arquivo"""
-        log_file = self.log_dir / f'extract_appsettings_{self.timestamp}.log'
+        self.log_dir.mkdir(exist_ok=True)
+        shard_suffix = f'_shard{self.shard_index:03d}' if self.shard_index is not None else ''
+        log_file = self.log_dir / f'extract_appsettings_{self.timestamp}{shard_suffix}.log'
         
-        # Logger principal
-        self.logger = logging.getLogger('AppSettingsExtractor')
+        # Logger principal (remove handlers de um extrator anterior no mesmo processo)
         self.logger.setLevel(logging.INFO)
+        for handler in list(self.logger.handlers):
+            if not isinstance(handler, logging.NullHandler):
+                self.logger.removeHandler(handler)
+                handler.close()
         
         # Handler para console com cores
         console_handler = logging.StreamHandler()
@@ -126,10 +1026,10 @@ class AppSettingsExtractor:
         
         self.logger.info(f"Log salvo em: {log_file}")
     
-    def _init_aws_clients(self):
+    def _init_aws_clients(self, session: Optional[boto3.Session] = None):
         """Inicializa clientes AWS"""
         try:
-            session = boto3.Session(profile_name=self.aws_profile)
+            session = session or boto3.Session(profile_name=self.aws_profile)
             self.ec2_client = session.client('ec2')
             self.ssm_client = session.client('ssm')
             
@@ -141,12 +1041,22 @@ class AppSettingsExtractor:
             
         except Exception as e:
             self.logger.error(f"Erro ao inicializar clientes AWS: {e}")
-            sys.exit(1)
+            raise AwsCredentialsError(f"Erro ao inicializar clientes AWS: {e}") from e
     
-    def find_windows_instances(self) -> List[WindowsInstance]:
-        """Busca instâncias Windows com filtro no nome"""
-        self.logger.info(f"Buscando instâncias Windows com '{self.server_filter}' no nome...")
-        
+    def _span(self, name: str, category: str = 'extractor', **args):
+        """Abre um span de trace (no-op quando --trace não foi usado)"""
+        if self.tracer is None:
+            return nullcontext(args)
+        return self.tracer.span(name, category, **args)
+    
+    def _cpu_profile(self):
+        """Perfila o bloco com cProfile (no-op quando --cprofile não foi usado)"""
+        if self.cpu_profiler is None:
+            return nullcontext()
+        return self.cpu_profiler.profile()
+    
+    def describe_windows_instances(self) -> List[WindowsInstance]:
+        """Lista a frota Windows com filtro no nome (levanta ExtractorError se a busca falhar)"""
         try:
             response = self.ec2_client.describe_instances(
                 Filters=[
@@ -155,23 +1065,48 @@ class AppSettingsExtractor:
                     {'Name': f'tag:Name', 'Values': [f'*{self.server_filter}*']}
                 ]
             )
+        except Exception as e:
+            raise ExtractorError(f"Erro ao buscar instâncias: {e}") from e
+        
+        instances = []
+        for reservation in response['Reservations']:
+            for instance in reservation['Instances']:
+                # Extrair nome da tag
+                name = 'Unknown'
+                for tag in instance.get('Tags', []):
+                    if tag['Key'] == 'Name':
+                        name = tag['Value']
+                        break
+                
+                instances.append(WindowsInstance(
+                    instance_id=instance['InstanceId'],
+                    name=name,
+                    private_ip=instance.get('PrivateIpAddress', 'N/A'),
+                    public_ip=instance.get('PublicIpAddress', 'N/A')
+                ))
+        
+        return instances
+    
+    def find_windows_instances(self, fleet: Optional[List[WindowsInstance]] = None
+                               ) -> List[WindowsInstance]:
+        """
+        Busca instâncias Windows com filtro no nome
+        
+        Com `fleet` (frota já listada, ex: compartilhada entre shards) não consulta o EC2;
+        apenas aplica o filtro do shard.
+        """
+        if fleet is None:
+            self.logger.info(f"Buscando instâncias Windows com '{self.server_filter}' no nome...")
+        
+        try:
+            instances = list(fleet) if fleet is not None else self.describe_windows_instances()
             
-            instances = []
-            for reservation in response['Reservations']:
-                for instance in reservation['Instances']:
-                    # Extrair nome da tag
-                    name = 'Unknown'
-                    for tag in instance.get('Tags', []):
-                        if tag['Key'] == 'Name':
-                            name = tag['Value']
-                            break
-                    
-                    instances.append(WindowsInstance(
-                        instance_id=instance['InstanceId'],
-                        name=name,
-                        private_ip=instance.get('PrivateIpAddress', 'N/A'),
-                        public_ip=instance.get('PublicIpAddress', 'N/A')
-                    ))
+            if self.shard_index is not None:
+                total = len(instances)
+                instances = [i for i in instances
+                             if shard_of(i.instance_id, self.shard_count) == self.shard_index]
+                self.logger.info(f"Shard {self.shard_index}/{self.shard_count}: "
+                                 f"{len(instances)} de {total} instâncias")
             
             self.stats['instances_found'] = len(instances)
             self.logger.info(f"Encontradas {len(instances)} instâncias")
@@ -182,8 +1117,8 @@ class AppSettingsExtractor:
             
             return instances
             
-        except Exception as e:
-            self.logger.error(f"Erro ao buscar instâncias: {e}")
+        except ExtractorError as e:
+            self.logger.error(str(e))
             return []
     
     def check_ssm_status(self, instance: WindowsInstance) -> bool:
@@ -218,64 +1153,268 @@ class AppSettingsExtractor:
             instance.ssm_status = 'Error'
             return False
     
-    def execute_ssm_command(self, instance_id: str, commands: List[str], 
-                           timeout: int = 30) -> Optional[str]:
-        """Executa comando via SSM e retorna o resultado"""
+    def execute_ssm_command(self, instance_id: str, commands: Optional[List[str]] = None,
+                           timeout: int = 30, label: str = 'ssm_command',
+                           parameters: Optional[Dict[str, List[str]]] = None) -> Optional[str]:
+        """
+        Executa comando via SSM e retorna o resultado
+        
+        Com `parameters`, invoca o documento do extrator (nome e versão registrados);
+        caso contrário envia `commands` via AWS-RunPowerShellScript.
+        """
+        with self._span(label, 'ssm', instance_id=instance_id) as span_args:
+            return self._execute_ssm_command(instance_id, commands, timeout, span_args, parameters)
+    
+    def _execute_ssm_command(self, instance_id: str, commands: Optional[List[str]],
+                             timeout: int, span_args: Dict[str, Any],
+                             parameters: Optional[Dict[str, List[str]]] = None) -> Optional[str]:
+        """Envia o comando e acompanha as fases send/queue/execute/poll"""
+        tracer = self.tracer
+        
+        if self.cancel_token.cancelled:
+            self.logger.debug(f"Comando não enviado para {instance_id}: execução cancelada")
+            span_args['status'] = 'NotSent'
+            return None
+        
         try:
-            response = self.ssm_client.send_command(
-                InstanceIds=[instance_id],
-                DocumentName='AWS-RunPowerShellScript',
-                Parameters={'commands': commands}
-            )
+            with self._span('ssm.send', 'ssm', instance_id=instance_id) as send_args:
+                if parameters is not None:
+                    response = self.ssm_client.send_command(
+                        InstanceIds=[instance_id],
+                        DocumentName=self.ssm_document_name,
+                        DocumentVersion=self.ssm_document_version,
+                        Parameters=parameters
+                    )
+                else:
+                    response = self.ssm_client.send_command(
+                        InstanceIds=[instance_id],
+                        DocumentName='AWS-RunPowerShellScript',
+                        Parameters={'commands': commands}
+                    )
+                command_id = response['Command']['CommandId']
+                send_args['command_id'] = command_id
             
-            command_id = response['Command']['CommandId']
+            span_args['command_id'] = command_id
+            
+            with self._inflight_lock:
+                self._inflight_commands[command_id] = (instance_id, self.cancel_token)
             
-            # Aguardar execução
-            time.sleep(3)
+            # Fases queue/execute vêm dos horários reportados pelo SSM (não do polling)
+            queued_at = tracer.now() if tracer else 0.0
+            result: Dict[str, Any] = {}
             
             # Tentar obter resultado com timeout
             start_time = time.time()
-            while time.time() - start_time < timeout:
-                try:
-                    result = self.ssm_client.get_command_invocation(
-                        CommandId=command_id,
-                        InstanceId=instance_id
-                    )
+            status = 'Pending'
+            try:
+                # Aguardar execução
+                if self.cancel_token.wait(3):
+                    status = self._cancel_remote_command(command_id, instance_id)
+                    return None
+                
+                while time.time() - start_time < timeout:
+                    try:
+                        with self._span('ssm.poll', 'ssm', command_id=command_id) as poll_args:
+                            result = self.ssm_client.get_command_invocation(
+                                CommandId=command_id,
+                                InstanceId=instance_id
+                            )
+                            poll_args['status'] = result['Status']
+                        
+                        status = result['Status']
+                        
+                        if status == 'Success':
+                            return result['StandardOutputContent']
+                        elif status in ['Failed', 'Cancelled', 'TimedOut']:
+                            self.logger.error(f"Comando falhou com status: {status}")
+                            if result.get('StandardErrorContent'):
+                                self.logger.error(f"Erro: {result['StandardErrorContent']}")
+                            return None
+                            
+                    except self.ssm_client.exceptions.InvocationDoesNotExist:
+                        pass
                     
-                    status = result['Status']
-                    if status == 'Success':
-                        return result['StandardOutputContent']
-                    elif status in ['Failed', 'Cancelled', 'TimedOut']:
-                        self.logger.error(f"Comando falhou com status: {status}")
-                        if result.get('StandardErrorContent'):
-                            self.logger.error(f"Erro: {result['StandardErrorContent']}")
+                    # Ainda executando, aguardar mais
+                    if self.cancel_token.wait(2):
+                        status = self._cancel_remote_command(command_id, instance_id)
                         return None
-                    else:
-                        # Ainda executando, aguardar mais
-                        time.sleep(2)
-                        
-                except self.ssm_client.exceptions.InvocationDoesNotExist:
-                    time.sleep(2)
-                    continue
+                
+                self.logger.warning(f"Timeout ao executar comando (>{timeout}s)")
+                status = self._cancel_remote_command(command_id, instance_id, 'LocalTimeout')
+                return None
             
-            self.logger.warning(f"Timeout ao executar comando (>{timeout}s)")
-            return None
+            except KeyboardInterrupt:
+                # Ctrl-C no modo sequencial: cancelar o comando e seguir como cancelamento,
+                # para que a instância devolva os arquivos já extraídos
+                self.logger.warning("⚠️ Interrupção recebida - cancelando comandos em andamento")
+                self.cancel_token.cancel('interrupt')
+                status = self._cancel_remote_command(command_id, instance_id)
+                return None
+            
+            finally:
+                with self._inflight_lock:
+                    self._inflight_commands.pop(command_id, None)
+                
+                span_args['status'] = status
+                if tracer:
+                    self._trace_command_phases(command_id, queued_at, result, status)
             
         except Exception as e:
             self.logger.error(f"Erro ao executar comando SSM: {e}")
             return None
     
-    def get_hostname(self, instance: WindowsInstance) -> str:
-        """Obtém o hostname da instância"""
-        self.logger.debug(f"Obtendo hostname de {instance.name}...")
+    def _trace_command_phases(self, command_id: str, queued_at: float,
+                              result: Dict[str, Any], status: str):
+        """Registra ssm.queue/ssm.execute a partir de ExecutionStart/EndDateTime"""
+        tracer = self.tracer
+        finished_at = tracer.now()
+        started = _parse_ssm_timestamp(result.get('ExecutionStartDateTime'))
         
-        result = self.execute_ssm_command(
-            instance.instance_id,
-            ['$env:COMPUTERNAME']
-        )
+        if started is None:
+            tracer.add_span('ssm.queue', queued_at, finished_at, 'ssm', command_id=command_id)
+            return
         
-        if result:
-            hostname = result.strip()
+        # Relógios local e da instância podem divergir: manter as fases dentro da janela local
+        ended = _parse_ssm_timestamp(result.get('ExecutionEndDateTime'))
+        running_at = min(max(tracer.from_wall_clock(started), queued_at), finished_at)
+        ended_at = finished_at if ended is None else tracer.from_wall_clock(ended)
+        ended_at = min(max(ended_at, running_at), finished_at)
+        
+        tracer.add_span('ssm.queue', queued_at, running_at, 'ssm', command_id=command_id)
+        tracer.add_span('ssm.execute', running_at, ended_at, 'ssm',
+                        command_id=command_id, status=status)
+    
+    def _cancel_remote_command(self, command_id: str, instance_id: Optional[str],
+                               status: str = 'CancelledLocally') -> str:
+        """Cancela no SSM um comando que não terá o resultado aguardado"""
+        try:
+            if instance_id is None:
+                self.ssm_client.cancel_command(CommandId=command_id)
+            else:
+                self.ssm_client.cancel_command(CommandId=command_id, InstanceIds=[instance_id])
+            self.stats['commands_cancelled'] += 1
+            self.logger.warning(f"🛑 Comando {command_id} cancelado em {instance_id or 'todos os alvos'}")
+        except Exception as e:
+            self.logger.error(f"Erro ao cancelar comando {command_id}: {e}")
+        return status
+    
+    def _cancel_inflight_commands(self, token: Optional[CancellationToken] = None):
+        """Cancela no SSM os comandos em andamento (só os da iteração de `token`, se informado)"""
+        with self._inflight_lock:
+            inflight = {command_id: instance_id
+                        for command_id, (instance_id, owner) in self._inflight_commands.items()
+                        if token is None or owner is token}
+            for command_id in inflight:
+                del self._inflight_commands[command_id]
+        
+        for command_id, instance_id in inflight.items():
+            self._cancel_remote_command(command_id, instance_id)
+    
+    def ensure_ssm_document(self) -> Optional[str]:
+        """Registra/atualiza o documento SSM do extrator e retorna a versão a usar (None = inline)"""
+        if self._ssm_document_checked:
+            return self.ssm_document_version
+        self._ssm_document_checked = True
+        
+        if not self.ssm_document_name:
+            return None
+        
+        try:
+            document = build_ssm_document()
+            content = json.dumps(document, indent=2)
+            self.ssm_document_version = self._register_ssm_document(document, content)
+            self.logger.info(f"📜 Documento SSM: {self.ssm_document_name} "
+                             f"(versão {self.ssm_document_version})")
+        except Exception as e:
+            self.logger.warning(f"⚠️ Não foi possível registrar o documento SSM "
+                                f"{self.ssm_document_name} ({e}) - usando comandos inline")
+            self.ssm_document_version = None
+        
+        return self.ssm_document_version
+    
+    def _register_ssm_document(self, document: Dict[str, Any], content: str) -> str:
+        """Cria o documento, reaproveita a versão idêntica ou publica uma nova versão"""
+        exceptions = self.ssm_client.exceptions
+        name = self.ssm_document_name
+        
+        try:
+            latest = self.ssm_client.get_document(Name=name, DocumentVersion='$LATEST',
+                                                  DocumentFormat='JSON')
+        except exceptions.InvalidDocument:
+            latest = None
+        
+        if latest is None:
+            try:
+                response = self.ssm_client.create_document(
+                    Content=content, Name=name,
+                    DocumentType='Command', DocumentFormat='JSON'
+                )
+                return response['DocumentDescription']['DocumentVersion']
+            except exceptions.DocumentAlreadyExists:
+                # Outro worker registrou ao mesmo tempo
+                return self._find_ssm_document_version(document)
+        
+        if json.loads(latest['Content']) == document:
+            return latest['DocumentVersion']
+        
+        try:
+            response = self.ssm_client.update_document(
+                Content=content, Name=name,
+                DocumentVersion='$LATEST', DocumentFormat='JSON'
+            )
+            return response['DocumentDescription']['DocumentVersion']
+        except exceptions.DuplicateDocumentContent:
+            # Conteúdo igual a uma versão anterior (ex: rollback do extrator)
+            return self._find_ssm_document_version(document)
+    
+    def _find_ssm_document_version(self, document: Dict[str, Any]) -> str:
+        """Procura a versão existente do documento com o mesmo conteúdo"""
+        paginator = self.ssm_client.get_paginator('list_document_versions')
+        for page in paginator.paginate(Name=self.ssm_document_name):
+            for version in page['DocumentVersions']:
+                existing = self.ssm_client.get_document(
+                    Name=self.ssm_document_name,
+                    DocumentVersion=version['DocumentVersion'],
+                    DocumentFormat='JSON'
+                )
+                if json.loads(existing['Content']) == document:
+                    return version['DocumentVersion']
+        
+        raise ExtractorError(f"Versão do documento {self.ssm_document_name} não encontrada")
+    
+    def run_document(self, instance_id: str, mode: str, path: str = '',
+                     patterns: str = '', timeout: int = 60,
+                     chunk: int = 0) -> Optional[Dict[str, Any]]:
+        """Invoca o documento SSM do extrator e retorna a saída JSON"""
+        result = self.execute_ssm_command(
+            instance_id,
+            timeout=timeout,
+            label=f"ssm.{mode.replace('-', '_')}",
+            parameters={'mode': [mode], 'path': [path], 'patterns': [patterns],
+                        'chunk': [str(chunk)]}
+        )
+        
+        if not result:
+            return None
+        
+        try:
+            return json.loads(result)
+        except ValueError:
+            self.logger.error(f"Saída inválida do documento SSM ({mode}) em {instance_id}")
+            return None
+    
+    def get_hostname(self, instance: WindowsInstance) -> str:
+        """Obtém o hostname da instância"""
+        self.logger.debug(f"Obtendo hostname de {instance.name}...")
+        
+        result = self.execute_ssm_command(
+            instance.instance_id,
+            ['$env:COMPUTERNAME'],
+            label='ssm.get_hostname'
+        )
+        
+        if result:
+            hostname = result.strip()
             instance.hostname = hostname
             self.logger.debug(f"Hostname: {hostname}")
             return hostname
@@ -290,7 +1429,8 @@ class AppSettingsExtractor:
         
         result = self.execute_ssm_command(
             instance.instance_id,
-            [f"Test-Path '{self.target_path}'"]
+            [f"Test-Path '{self.target_path}'"],
+            label='ssm.check_directory'
         )
         
         if result and result.strip() == 'True':
@@ -300,53 +1440,239 @@ class AppSettingsExtractor:
             self.logger.warning(f"❌ Diretório {self.target_path} não encontrado em {instance.name}")
             return False
     
-    def extract_appsettings_files(self, instance: WindowsInstance) -> Dict[str, str]:
+    def discover_iis_sites(self, instance: WindowsInstance) -> Dict[str, str]:
+        """Descobre os sites IIS e caminhos físicos da instância (com cache no inventário)"""
+        cached = None if self.refresh_inventory else self.inventory.get(instance.instance_id)
+        
+        # Instância sem sites também fica em cache (sites vazio não força nova descoberta)
+        if cached is not None:
+            instance.hostname = cached.get('hostname') or instance.hostname
+            instance.sites = cached.get('sites') or {}
+            self.logger.info(f"📒 {len(instance.sites)} sites de {instance.name} obtidos do inventário")
+            return instance.sites
+        
+        self.logger.debug(f"Descobrindo sites IIS de {instance.name}...")
+        
+        # Hostname e sites numa única chamada SSM
+        if self.ssm_document_version:
+            discovery = self.run_document(instance.instance_id, 'discover-sites')
+        else:
+            result = self.execute_ssm_command(
+                instance.instance_id,
+                [
+                    "$ErrorActionPreference = 'Stop'",
+                    "Import-Module WebAdministration",
+                    "$sites = @(Get-Website | ForEach-Object { [PSCustomObject]@{ "
+                    "name = $_.Name; path = [Environment]::ExpandEnvironmentVariables($_.PhysicalPath) } })",
+                    "[PSCustomObject]@{ hostname = $env:COMPUTERNAME; sites = $sites } | "
+                    "ConvertTo-Json -Compress -Depth 3"
+                ],
+                label='ssm.discover_sites'
+            )
+            
+            try:
+                discovery = json.loads(result) if result else None
+            except ValueError:
+                discovery = None
+        
+        if not discovery:
+            self.logger.warning(f"❌ Não foi possível descobrir sites IIS de {instance.name}")
+            return {}
+        
+        instance.hostname = discovery.get('hostname') or 'unknown'
+        instance.sites = {
+            site['name']: site['path'].rstrip('\\')
+            for site in discovery.get('sites') or []
+            if site.get('name') and site.get('path')
+        }
+        
+        self.inventory.update(instance)
+        self.logger.info(f"🌐 {len(instance.sites)} sites IIS descobertos em {instance.name}")
+        for site_name, site_path in instance.sites.items():
+            self.logger.debug(f"  {site_name}: {site_path}")
+        
+        return instance.sites
+    
+    @staticmethod
+    def _site_dir_name(site_name: str) -> str:
+        """Nome de diretório local seguro para um site IIS"""
+        return re.sub(r'[<>:"/\\|?*]', '_', site_name).strip(' .') or 'site'
+    
+    @classmethod
+    def _site_dir_names(cls, site_names: Iterable[str]) -> Dict[str, str]:
+        """Diretório local por site, desambiguando nomes que colidem após a sanitização"""
+        used = set()
+        dir_names = {}
+        
+        # Ordem estável para que cada site caia sempre no mesmo diretório
+        for site_name in sorted(site_names):
+            base = cls._site_dir_name(site_name)
+            dir_name, suffix = base, 2
+            while dir_name.lower() in used:
+                dir_name = f"{base}_{suffix}"
+                suffix += 1
+            used.add(dir_name.lower())
+            dir_names[site_name] = dir_name
+        
+        return dir_names
+    
+    def extract_appsettings_files(self, instance: WindowsInstance,
+                                  target_path: Optional[str] = None,
+                                  local_prefix: str = '') -> Dict[str, str]:
         """Extrai arquivos appsettings.json da instância"""
+        target_path = target_path or self.target_path
         self.logger.info(f"📁 Extraindo arquivos de {instance.name}...")
         
+        if self.ssm_document_version:
+            return self._extract_with_document(instance, target_path, local_prefix)
+        
         files_content = {}
         
         # Lista de arquivos para extrair
         files_to_extract = [
-            'appsettings.json',
-            f'appsettings.{instance.hostname}.json'
+            pattern.replace('{hostname}', instance.hostname or 'unknown')
+            for pattern in APPSETTINGS_PATTERNS
         ]
         
         for filename in files_to_extract:
-            file_path = f"{self.target_path}\\{filename}"
+            file_path = f"{target_path}\\{filename}"
+            local_name = f"{local_prefix}/{filename}" if local_prefix else filename
             
-            self.logger.debug(f"Tentando extrair: {filename}")
+            self.logger.debug(f"Tentando extrair: {local_name}")
             
             result = self.execute_ssm_command(
                 instance.instance_id,
                 [f"if (Test-Path '{file_path}') {{ Get-Content '{file_path}' -Raw }} else {{ 'FILE_NOT_FOUND' }}"],
-                timeout=60
+                timeout=60,
+                label='ssm.get_content'
             )
             
             if result and result.strip() != 'FILE_NOT_FOUND':
-                files_content[filename] = result
-                self.logger.info(f"✅ Extraído: {filename}")
+                files_content[local_name] = result
+                instance.remote_paths[local_name] = file_path
+                self.logger.info(f"✅ Extraído: {local_name}")
                 self.stats['files_extracted'] += 1
             else:
-                self.logger.warning(f"❌ Arquivo não encontrado: {filename}")
+                self.logger.warning(f"❌ Arquivo não encontrado: {local_name}")
         
         return files_content
     
-    def save_files(self, instance: WindowsInstance, files_content: Dict[str, str]) -> int:
-        """Salva arquivos extraídos no sistema local"""
+    def _extract_with_document(self, instance: WindowsInstance, target_path: str,
+                               local_prefix: str) -> Dict[str, str]:
+        """Hostname, diretório e lista de arquivos numa invocação; depois um read-file por arquivo"""
+        output = self.run_document(instance.instance_id, 'get-content', target_path,
+                                   ','.join(APPSETTINGS_PATTERNS))
+        if output is None:
+            return {}
+        
+        if not instance.hostname:
+            instance.hostname = output.get('hostname') or 'unknown'
+        
+        if not output.get('exists'):
+            self.logger.warning(f"❌ Diretório {target_path} não encontrado em {instance.name}")
+            return {}
+        
+        files_content = {}
+        for filename, size in (output.get('files') or {}).items():
+            local_name = f"{local_prefix}/{filename}" if local_prefix else filename
+            
+            if size is None:
+                self.logger.warning(f"❌ Arquivo não encontrado: {local_name}")
+                continue
+            if self.cancel_token.cancelled:
+                break
+            
+            remote_path = f"{target_path}\\{filename}"
+            raw = self._read_remote_file(instance, remote_path)
+            if raw is None:
+                error_msg = f"Falha ao ler {local_name} de {instance.name}"
+                self.logger.error(f"❌ {error_msg}")
+                self.stats['errors'].append(error_msg)
+                continue
+            
+            files_content[local_name] = _decode_remote_file(raw)
+            instance.raw_files[local_name] = raw
+            instance.remote_paths[local_name] = remote_path
+            self.logger.info(f"✅ Extraído: {local_name} ({len(raw)} bytes)")
+            self.stats['files_extracted'] += 1
+        
+        return files_content
+    
+    def _read_remote_file(self, instance: WindowsInstance, remote_path: str) -> Optional[bytes]:
+        """Lê um arquivo via read-file (gzip+base64, paginado) e confere o sha256 reportado"""
+        pages: List[str] = []
+        sha256 = None
+        chunks = 1
+        
+        while len(pages) < chunks:
+            page = self.run_document(instance.instance_id, 'read-file', remote_path,
+                                     chunk=len(pages))
+            if not page:
+                return None
+            
+            # Arquivo alterado entre as páginas: as partes não se combinam
+            if sha256 is not None and page.get('sha256') != sha256:
+                self.logger.warning(f"Arquivo {remote_path} mudou durante a leitura em {instance.name}")
+                return None
+            
+            sha256 = page.get('sha256')
+            chunks = int(page.get('chunks') or 1)
+            pages.append(page.get('data') or '')
+        
+        try:
+            raw = gzip.decompress(base64.b64decode(''.join(pages)))
+        except Exception as e:
+            self.logger.error(f"Conteúdo inválido de {remote_path} em {instance.name}: {e}")
+            return None
+        
+        if hashlib.sha256(raw).hexdigest() != sha256:
+            self.logger.error(f"sha256 divergente ao ler {remote_path} em {instance.name}")
+            return None
+        
+        return raw
+    
+    def extract_site_files(self, instance: WindowsInstance) -> Dict[str, str]:
+        """Extrai os arquivos de todos os sites IIS descobertos na instância"""
+        files_content = {}
+        sites = instance.sites or {}
+        dir_names = self._site_dir_names(sites)
+        
+        for site_name, site_path in sites.items():
+            if self.cancel_token.cancelled:
+                break
+            
+            with self._span('extract_site', site=site_name):
+                files_content.update(self.extract_appsettings_files(
+                    instance, site_path, dir_names[site_name]
+                ))
+        
+        return files_content
+    
+    def save_files(self, instance: WindowsInstance, files_content: Dict[str, str],
+                   raw_files: Optional[Dict[str, bytes]] = None) -> int:
+        """
+        Salva arquivos extraídos no sistema local
+        
+        Arquivos com bytes originais (`raw_files`) são gravados exatamente como estão no
+        servidor (encoding, BOM e CRLF), para que o restore devolva o mesmo conteúdo.
+        """
+        raw_files = raw_files or {}
         if not files_content:
             return 0
         
         # Criar diretório para a instância
         instance_dir = self.backup_dir / instance.name
-        instance_dir.mkdir(exist_ok=True)
+        instance_dir.mkdir(parents=True, exist_ok=True)
         
         files_saved = 0
         
         for filename, content in files_content.items():
             try:
                 file_path = instance_dir / filename
-                file_path.write_text(content, encoding='utf-8')
+                file_path.parent.mkdir(parents=True, exist_ok=True)
+                # Bytes, não write_text: no Windows o modo texto transformaria \r\n em \r\r\n
+                data = raw_files.get(filename)
+                file_path.write_bytes(data if data is not None else content.encode('utf-8'))
                 files_saved += 1
                 self.logger.debug(f"💾 Salvo: {file_path}")
                 
@@ -365,9 +1691,15 @@ class AppSettingsExtractor:
             'extraction_date': datetime.now().isoformat(),
             'files_extracted': list(files_content.keys()),
             'files_count': len(files_content),
-            'ssm_status': instance.ssm_status
+            'ssm_status': instance.ssm_status,
+            'remote_paths': {name: instance.remote_paths[name] for name in files_content
+                             if name in instance.remote_paths}
         }
         
+        if instance.sites is not None:
+            metadata['target_path'] = None
+            metadata['sites'] = instance.sites
+        
         metadata_path = instance_dir / 'metadata.json'
         metadata_path.write_text(json.dumps(metadata, indent=2), encoding='utf-8')
         
@@ -375,103 +1707,650 @@ class AppSettingsExtractor:
         
         return files_saved
     
-    def process_instance(self, instance: WindowsInstance) -> bool:
-        """Processa uma instância completa"""
+    def process_instance(self, instance: WindowsInstance) -> ExtractionResult:
+        """Processa uma instância completa (etapas remotas) e retorna o resultado"""
+        started = time.monotonic()
+        with self._span('process_instance', instance=instance.name,
+                        instance_id=instance.instance_id) as span_args:
+            result = self._process_instance_steps(instance)
+            result.duration_seconds = time.monotonic() - started
+            span_args['status'] = result.status
+            return result
+    
+    def _process_instance_steps(self, instance: WindowsInstance) -> ExtractionResult:
+        """Executa as etapas de processamento de uma instância"""
+        # Cancelada antes de começar: não iniciada (não conta como interrompida)
+        if self.cancel_token.cancelled:
+            self.logger.debug(f"{instance.name} não iniciada ({self.cancel_token.reason})")
+            return ExtractionResult(instance, 'not_started', error='Não iniciada')
+        
         self.logger.info(f"🔄 Processando: {instance.name} ({instance.instance_id})")
+        files_content: Dict[str, str] = {}
         
         try:
             self.stats['instances_processed'] += 1
             
             # 1. Verificar SSM
-            if not self.check_ssm_status(instance):
-                return False
-            
-            # 2. Obter hostname
-            self.get_hostname(instance)
+            with self._span('check_ssm_status'):
+                if not self.check_ssm_status(instance):
+                    return ExtractionResult(instance, 'failed',
+                                            error=f"SSM indisponível ({instance.ssm_status})")
             
-            # 3. Verificar diretório
-            if not self.check_directory_exists(instance):
-                return False
+            if self.discover_sites:
+                # 2-3. Descobrir sites IIS (hostname vem junto)
+                with self._span('discover_iis_sites'):
+                    sites = self.discover_iis_sites(instance)
+                
+                if self._stop_requested(instance):
+                    return ExtractionResult(instance, 'cancelled')
+                if not sites:
+                    return ExtractionResult(instance, 'failed', error='Nenhum site IIS descoberto')
+                
+                # 4. Extrair arquivos de todos os sites
+                with self._span('extract_site_files'):
+                    files_content = self.extract_site_files(instance)
+            elif self.ssm_document_version:
+                # 2-4. Hostname, diretório e arquivos numa única invocação do documento
+                with self._span('extract_appsettings_files'):
+                    files_content = self.extract_appsettings_files(instance)
+            else:
+                # 2. Obter hostname
+                with self._span('get_hostname'):
+                    self.get_hostname(instance)
+                
+                if self._stop_requested(instance):
+                    return ExtractionResult(instance, 'cancelled')
+                
+                # 3. Verificar diretório
+                with self._span('check_directory_exists'):
+                    directory_exists = self.check_directory_exists(instance)
+                
+                if self._stop_requested(instance):
+                    return ExtractionResult(instance, 'cancelled')
+                if not directory_exists:
+                    return ExtractionResult(instance, 'failed',
+                                            error=f"Diretório {self.target_path} não encontrado")
+                
+                # 4. Extrair arquivos
+                with self._span('extract_appsettings_files'):
+                    files_content = self.extract_appsettings_files(instance)
             
-            # 4. Extrair arquivos
-            files_content = self.extract_appsettings_files(instance)
+            # Cancelado no meio da extração: devolve o que já foi extraído
+            if self._stop_requested(instance):
+                return ExtractionResult(instance, 'cancelled', files_content)
             
             if not files_content:
                 self.logger.warning(f"Nenhum arquivo extraído de {instance.name}")
-                return False
-            
-            # 5. Salvar arquivos
-            files_saved = self.save_files(instance, files_content)
+                return ExtractionResult(instance, 'failed', error='Nenhum arquivo extraído')
             
-            if files_saved > 0:
-                self.stats['instances_successful'] += 1
-                self.logger.info(f"✅ Concluído: {instance.name} - {files_saved} arquivos salvos")
-                return True
-            else:
-                self.logger.error(f"❌ Falha ao salvar arquivos de {instance.name}")
-                return False
+            return ExtractionResult(instance, 'success', files_content)
+        
+        except KeyboardInterrupt:
+            # Ctrl-C fora de um comando SSM: devolver o que já foi extraído
+            self.cancel_token.cancel('interrupt')
+            self._stop_requested(instance)
+            return ExtractionResult(instance, 'cancelled', files_content)
                 
         except Exception as e:
             error_msg = f"Erro ao processar {instance.name}: {e}"
             self.logger.error(error_msg)
             self.stats['errors'].append(error_msg)
+            return ExtractionResult(instance, 'failed', files_content, error=error_msg)
+    
+    def _stop_requested(self, instance: WindowsInstance) -> bool:
+        """Verifica o cancelamento entre etapas e contabiliza a instância cancelada"""
+        if not self.cancel_token.cancelled:
             return False
+        
+        self.stats['instances_cancelled'] += 1
+        self.logger.warning(f"⏹️ {instance.name} interrompida ({self.cancel_token.reason})")
+        return True
+    
+    def run(self, fleet: Optional[List[WindowsInstance]] = None) -> bool:
+        """Executa o processo completo de extração (fleet: frota já listada, opcional)"""
+        try:
+            with self._cpu_profile(), self._span('run'):
+                return self._run(fleet)
+        finally:
+            self._export_profiling()
     
-    def run(self) -> bool:
-        """Executa o processo completo de extração"""
+    def _run(self, fleet: Optional[List[WindowsInstance]] = None) -> bool:
+        """Etapas da extração (descoberta, processamento e relatório)"""
         self.logger.info("🚀 Iniciando extração de arquivos appsettings.json")
         self.logger.info(f"Profile AWS: {self.aws_profile}")
         self.logger.info(f"Filtro de servidor: {self.server_filter}")
+        if self.discover_sites:
+            self.logger.info(f"Descoberta de sites IIS (inventário: {self.inventory.path})")
+        else:
+            self.logger.info(f"Caminho alvo: {self.target_path}")
         self.logger.info(f"Diretório de backup: {self.backup_dir}")
         self.logger.info(f"Operações simultâneas: {self.concurrent_operations}")
+        if self.deadline_seconds:
+            self.logger.info(f"Prazo total: {self.deadline_seconds:.0f}s")
         
         # 1. Buscar instâncias
-        instances = self.find_windows_instances()
+        with self._span('find_windows_instances'):
+            instances = self.find_windows_instances(fleet)
         
         if not instances:
             self.logger.error("❌ Nenhuma instância encontrada")
+            self._write_run_report()
             return False
         
-        # 2. Processar instâncias (pode ser concorrente)
-        if self.concurrent_operations > 1:
-            self._process_instances_concurrent(instances)
-        else:
-            self._process_instances_sequential(instances)
+        # 2. Processar instâncias (pode ser concorrente) e salvar no diretório de backup
+        try:
+            for result in self._iter_results(instances, [BackupDirectorySink(self)], self._run_token):
+                status = {'success': "✅ Sucesso", 'cancelled': "⏹️ Interrompida",
+                          'not_started': "⏭️ Não iniciada"}.get(result.status, "❌ Falha")
+                self.logger.info(f"{status}: {result.instance.name}")
+                self._add_to_manifest(result)
+        except KeyboardInterrupt:
+            self.logger.warning("⚠️ Interrupção recebida - cancelando comandos em andamento")
+            self.cancel_token.cancel('interrupt')
+        
+        # Instâncias que não chegaram a ser produzidas também entram no manifesto (re-execução)
+        listed = {entry['instance_id'] for entry in self.manifest}
+        for instance in instances:
+            if instance.instance_id not in listed:
+                self._add_to_manifest(ExtractionResult(instance, 'not_started', error='Não iniciada'))
         
-        # 3. Relatório final
+        # 3. Validar e normalizar os arquivos salvos
+        if self.validate and self.backup_dir.exists():
+            with self._span('validate_configs'):
+                self.validate_configs()
+        
+        # 4. Relatório final
         self._generate_final_report()
         
         return self.stats['instances_successful'] > 0
     
-    def _process_instances_sequential(self, instances: List[WindowsInstance]):
+    def _add_to_manifest(self, result: ExtractionResult):
+        """Registra o resultado da instância no manifesto do run_report.json"""
+        self.manifest.append({
+            'instance_id': result.instance.instance_id,
+            'instance_name': result.instance.name,
+            'status': result.status,
+            'files': list(result.files),
+            'error': result.error,
+            'duration_seconds': round(result.duration_seconds, 3)
+        })
+    
+    def validate_configs(self) -> Dict[str, Any]:
+        """Valida e canonicaliza em paralelo os arquivos do diretório de backup"""
+        self.logger.info("🔎 Validando arquivos extraídos...")
+        report = validate_snapshot(self.backup_dir, self.validate_workers)
+        
+        for name, info in report['files'].items():
+            if info['status'] != 'valid':
+                error_msg = f"JSON {'truncado' if info['status'] == 'truncated' else 'inválido'}: {name} - {info['error']}"
+                self.logger.error(f"❌ {error_msg}")
+                self.stats['errors'].append(error_msg)
+            elif info['duplicate_keys']:
+                self.logger.warning(f"⚠️ Chaves duplicadas em {name}: {', '.join(info['duplicate_keys'])}")
+        
+        summary = report['summary']
+        self.stats['files_invalid'] = summary['invalid'] + summary['truncated']
+        self.logger.info(f"🔎 Validação: {summary['valid']} válidos, {summary['invalid']} inválidos, "
+                         f"{summary['truncated']} truncados - {report['unique_contents']} conteúdos distintos")
+        
+        return report
+    
+    def restore_snapshot(self, snapshot_dir: Path, wave_size: int = 50,
+                         max_concurrency: str = '25%', max_errors: str = '0',
+                         wave_timeout: int = 600) -> bool:
+        """
+        Restaura os arquivos de um snapshot nas instâncias, em ondas
+        
+        Arquivos idênticos no mesmo caminho remoto viram um único send_command com
+        vários alvos (fan-out no SSM com MaxConcurrency/MaxErrors). O conteúdo vai
+        comprimido (gzip+base64) e o sha256 é conferido no servidor após a escrita.
+        Uma onda que estoure o orçamento de erros interrompe as seguintes.
+        """
+        try:
+            with self._cpu_profile(), self._span('restore', snapshot=str(snapshot_dir)):
+                return self._restore_snapshot(snapshot_dir, wave_size, max_concurrency,
+                                              max_errors, wave_timeout)
+        finally:
+            self._export_profiling()
+    
+    def _restore_snapshot(self, snapshot_dir: Path, wave_size: int, max_concurrency: str,
+                          max_errors: str, wave_timeout: int) -> bool:
+        """Etapas do restore (carga, agrupamento, ondas e relatório)"""
+        self.logger.info(f"♻️ Restaurando snapshot: {snapshot_dir}")
+        
+        targets, warnings = load_restore_targets(snapshot_dir)
+        for warning in warnings:
+            self.logger.warning(f"⚠️ Ignorado: {warning}")
+        
+        if not targets:
+            self.logger.error("❌ Nenhum arquivo para restaurar")
+            return False
+        
+        self.ensure_ssm_document()
+        
+        # Agrupar alvos com o mesmo conteúdo no mesmo caminho (máx. 50 instâncias por comando)
+        groups: Dict[Tuple[str, str], List[RestoreTarget]] = {}
+        for target in targets:
+            groups.setdefault((target.remote_path, target.sha256), []).append(target)
+        
+        batch_size = max(1, min(50, wave_size))
+        batches = [
+            group[start:start + batch_size]
+            for group in groups.values()
+            for start in range(0, len(group), batch_size)
+        ]
+        
+        # Montar as ondas por número de alvos
+        waves: List[List[List[RestoreTarget]]] = [[]]
+        wave_targets = 0
+        for batch in batches:
+            if waves[-1] and wave_targets + len(batch) > wave_size:
+                waves.append([])
+                wave_targets = 0
+            waves[-1].append(batch)
+            wave_targets += len(batch)
+        
+        instances = {target.instance_id for target in targets}
+        self.logger.info(f"{len(targets)} arquivos em {len(instances)} instâncias - "
+                         f"{len(batches)} comandos em {len(waves)} ondas "
+                         f"(MaxConcurrency={max_concurrency}, MaxErrors={max_errors})")
+        
+        try:
+            for number, wave in enumerate(waves, 1):
+                if self.cancel_token.cancelled:
+                    break
+                
+                wave_count = sum(len(batch) for batch in wave)
+                self.logger.info(f"🌊 Onda {number}/{len(waves)}: {wave_count} arquivos")
+                
+                with self._span('restore_wave', wave=number, targets=wave_count):
+                    self._run_restore_wave(wave, max_concurrency, max_errors, wave_timeout)
+                
+                failed = sum(1 for batch in wave for target in batch if target.status != 'success')
+                if (failed > _error_budget(max_errors, wave_count) and number < len(waves)
+                        and not self.cancel_token.cancelled):
+                    self.logger.error(f"❌ Onda {number} com {failed} falhas - interrompendo restore")
+                    break
+        except KeyboardInterrupt:
+            # Nova interrupção durante o cancelamento/coleta: ainda cancelar e relatar
+            self.cancel_token.cancel('interrupt')
+        
+        if self.cancel_token.cancelled:
+            self._cancel_inflight_commands()
+        
+        return self._report_restore(snapshot_dir, targets)
+    
+    def _run_restore_wave(self, wave: List[List[RestoreTarget]], max_concurrency: str,
+                          max_errors: str, wave_timeout: int):
+        """Envia todos os comandos da onda e aguarda até o fim (ou prazo da onda)"""
+        pending: Dict[str, List[RestoreTarget]] = {}
+        
+        try:
+            for batch in wave:
+                if self.cancel_token.cancelled:
+                    break
+                command_id = self._send_restore_command(batch, max_concurrency, max_errors)
+                if command_id:
+                    pending[command_id] = batch
+                    with self._inflight_lock:
+                        self._inflight_commands[command_id] = (None, self.cancel_token)
+            
+            started = time.monotonic()
+            while pending:
+                if self.cancel_token.wait(3):
+                    break
+                
+                for command_id in list(pending):
+                    try:
+                        command = self.ssm_client.list_commands(CommandId=command_id)['Commands'][0]
+                    except Exception as e:
+                        self.logger.debug(f"Erro ao consultar comando {command_id}: {e}")
+                        continue
+                    
+                    if command['Status'] in ('Pending', 'InProgress', 'Cancelling'):
+                        continue
+                    
+                    self._collect_restore_results(command_id, pending.pop(command_id))
+                    with self._inflight_lock:
+                        self._inflight_commands.pop(command_id, None)
+                
+                if pending and time.monotonic() - started > wave_timeout:
+                    self.logger.warning(f"Timeout da onda (>{wave_timeout}s)")
+                    break
+        
+        except KeyboardInterrupt:
+            self.logger.warning("⚠️ Interrupção recebida - cancelando comandos em andamento")
+            self.cancel_token.cancel('interrupt')
+        
+        # Comandos sem resultado (timeout ou cancelamento): cancelar e coletar o que houver
+        for command_id, batch in pending.items():
+            self._cancel_remote_command(command_id, None)
+            with self._inflight_lock:
+                self._inflight_commands.pop(command_id, None)
+            self._collect_restore_results(command_id, batch)
+    
+    def _send_restore_command(self, batch: List[RestoreTarget], max_concurrency: str,
+                              max_errors: str) -> Optional[str]:
+        """Envia o conteúdo comprimido de um arquivo para todas as instâncias do lote"""
+        target = batch[0]
+        payload = base64.b64encode(gzip.compress(target.local_file.read_bytes())).decode('ascii')
+        parameters = {
+            'mode': ['put-content'],
+            'path': [target.remote_path],
+            'content': [payload],
+            'sha256': [target.sha256]
+        }
+        
+        if self.ssm_document_version:
+            document = {'DocumentName': self.ssm_document_name,
+                        'DocumentVersion': self.ssm_document_version,
+                        'Parameters': parameters}
+        else:
+            document = {'DocumentName': 'AWS-RunPowerShellScript',
+                        'Parameters': {'commands': ssm_document_commands(parameters)}}
+        
+        try:
+            with self._span('ssm.send', 'ssm', targets=len(batch), path=target.remote_path):
+                response = self.ssm_client.send_command(
+                    InstanceIds=[t.instance_id for t in batch],
+                    MaxConcurrency=max_concurrency,
+                    MaxErrors=max_errors,
+                    **document
+                )
+            command_id = response['Command']['CommandId']
+            self.logger.debug(f"Comando {command_id}: {target.remote_path} -> {len(batch)} instâncias "
+                              f"({len(payload)} bytes)")
+            return command_id
+        
+        except Exception as e:
+            error_msg = f"Erro ao enviar restore de {target.remote_path}: {e}"
+            self.logger.error(error_msg)
+            self.stats['errors'].append(error_msg)
+            for failed in batch:
+                failed.status = 'failed'
+                failed.error = str(e)
+            return None
+    
+    def _collect_restore_results(self, command_id: str, batch: List[RestoreTarget]):
+        """Confere o hash reportado por cada instância do comando"""
+        invocations = {}
+        try:
+            paginator = self.ssm_client.get_paginator('list_command_invocations')
+            for page in paginator.paginate(CommandId=command_id, Details=True):
+                for invocation in page['CommandInvocations']:
+                    invocations[invocation['InstanceId']] = invocation
+        except Exception as e:
+            self.logger.error(f"Erro ao obter resultados do comando {command_id}: {e}")
+        
+        for target in batch:
+            invocation = invocations.get(target.instance_id)
+            if invocation is None:
+                # Não entregue (ex: MaxErrors atingido antes desta instância)
+                target.status = 'skipped'
+                target.error = 'Comando não executado nesta instância'
+                continue
+            
+            output = ''.join(plugin.get('Output', '') for plugin in invocation.get('CommandPlugins', []))
+            try:
+                written = json.loads(output.strip().splitlines()[-1])
+            except (ValueError, IndexError):
+                written = {}
+            
+            if invocation['Status'] == 'Success' and written.get('sha256') == target.sha256:
+                target.status = 'success'
+                self.logger.info(f"✅ Restaurado: {target.instance_name} {target.remote_path}")
+            else:
+                target.status = 'failed'
+                target.error = (f"hash divergente ({written['sha256']})" if written.get('sha256')
+                                else f"status {invocation['Status']}")
+                self.logger.error(f"❌ Falha no restore: {target.instance_name} "
+                                  f"{target.remote_path} - {target.error}")
+    
+    def _report_restore(self, snapshot_dir: Path, targets: List[RestoreTarget]) -> bool:
+        """Relatório final do restore (log + restore_report_<timestamp>.json)"""
+        for target in targets:
+            if target.status == 'pending':
+                target.status = 'skipped'
+                target.error = target.error or 'Onda não executada'
+        
+        summary = {status: sum(1 for t in targets if t.status == status)
+                   for status in ('success', 'failed', 'skipped')}
+        
+        self.logger.info("=" * 50)
+        self.logger.info("📊 RELATÓRIO DO RESTORE")
+        self.logger.info("=" * 50)
+        self.logger.info(f"Arquivos restaurados: {summary['success']}/{len(targets)}")
+        if summary['failed']:
+            self.logger.warning(f"Arquivos com falha: {summary['failed']}")
+        if summary['skipped']:
+            self.logger.warning(f"Arquivos não executados: {summary['skipped']}")
+        if self.cancel_token.cancelled:
+            self.logger.warning(f"⏹️ Restore interrompido ({self.cancel_token.reason}) - relatório parcial")
+        
+        report = {
+            'status': 'partial' if self.cancel_token.cancelled else 'completed',
+            'cancel_reason': self.cancel_token.reason,
+            'snapshot': str(snapshot_dir),
+            'report_date': datetime.now().isoformat(),
+            'summary': summary,
+            'files': [
+                {'instance_id': t.instance_id, 'instance_name': t.instance_name,
+                 'remote_path': t.remote_path, 'sha256': t.sha256,
+                 'status': t.status, 'error': t.error}
+                for t in targets
+            ]
+        }
+        
+        report_path = snapshot_dir / f'restore_report_{self.timestamp}.json'
+        try:
+            report_path.write_text(json.dumps(report, indent=2), encoding='utf-8')
+            self.logger.info(f"📄 Relatório salvo em: {report_path}")
+        except Exception as e:
+            self.logger.error(f"Erro ao salvar relatório: {e}")
+        
+        return summary['success'] == len(targets)
+    
+    def _save_inventory(self):
+        """Grava o inventário de sites IIS descobertos"""
+        try:
+            self.inventory.save()
+            self.logger.info(f"📒 Inventário de sites salvo em: {self.inventory.path}")
+        except Exception as e:
+            self.logger.error(f"Erro ao salvar inventário: {e}")
+    
+    def _export_profiling(self):
+        """Salva o trace e o perfil de CPU, se habilitados"""
+        if self.tracer is not None:
+            try:
+                events = self.tracer.export(self.trace_file)
+                self.logger.info(f"🧭 Trace salvo em: {self.trace_file} ({events} spans)")
+            except Exception as e:
+                self.logger.error(f"Erro ao salvar trace: {e}")
+        
+        if self.cpu_profiler is not None:
+            try:
+                if self.cpu_profiler.dump(self.cprofile_file):
+                    self.logger.info(f"🧮 Perfil de CPU salvo em: {self.cprofile_file}")
+            except Exception as e:
+                self.logger.error(f"Erro ao salvar perfil de CPU: {e}")
+    
+    def iter_results(self, instances: Optional[List[WindowsInstance]] = None,
+                     sinks: Optional[Iterable[ResultSink]] = None) -> Iterator[ExtractionResult]:
+        """
+        Processa as instâncias e produz um resultado por instância assim que ela termina
+        
+        Args:
+            instances: Instâncias a processar (padrão: find_windows_instances())
+            sinks: Destinos chamados com cada resultado antes de ele ser produzido
+        
+        Fechar o gerador antes do fim cancela esta iteração e os comandos dela; iterações
+        seguintes no mesmo extrator não são afetadas (o prazo global continua valendo).
+        Ctrl+C (KeyboardInterrupt) também cancela: as instâncias em andamento ainda são
+        produzidas como 'cancelled', com os arquivos já extraídos, e as que não começaram
+        como 'not_started'.
+        """
+        return self._iter_results(instances, sinks, self._run_token.child())
+    
+    def _iter_results(self, instances: Optional[List[WindowsInstance]],
+                      sinks: Optional[Iterable[ResultSink]],
+                      token: CancellationToken) -> Iterator[ExtractionResult]:
+        """Corpo de iter_results com o token da iteração (run() usa o token da execução)"""
+        if instances is None:
+            with self._span('find_windows_instances'):
+                instances = self.find_windows_instances()
+        
+        # Registra o documento SSM uma vez antes de processar a frota
+        with self._span('ensure_ssm_document'):
+            self.ensure_ssm_document()
+        
+        sinks = list(sinks or [])
+        
+        if self.concurrent_operations > 1:
+            results = self._iter_concurrent(instances, token)
+        else:
+            results = self._iter_sequential(instances, token)
+        
+        try:
+            for result in results:
+                for sink in sinks:
+                    try:
+                        sink.write(result)
+                    except Exception as e:
+                        error_msg = f"Erro no destino {type(sink).__name__} para {result.instance.name}: {e}"
+                        self.logger.error(error_msg)
+                        self.stats['errors'].append(error_msg)
+                
+                if result.success:
+                    self.stats['instances_successful'] += 1
+                
+                yield result
+        finally:
+            results.close()
+            
+            if token.cancelled:
+                self._cancel_inflight_commands(token)
+            
+            if self.inventory is not None:
+                self._save_inventory()
+    
+    async def aiter_results(self, instances: Optional[List[WindowsInstance]] = None,
+                            sinks: Optional[Iterable[ResultSink]] = None
+                            ) -> AsyncIterator[ExtractionResult]:
+        """Versão assíncrona de iter_results (o processamento roda numa thread à parte)"""
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        done = object()
+        
+        # Token próprio: o fechamento tardio deste gerador não cancela iterações seguintes
+        token = self._run_token.child()
+        
+        def produce():
+            try:
+                for result in self._iter_results(instances, sinks, token):
+                    loop.call_soon_threadsafe(queue.put_nowait, result)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+        
+        producer = loop.run_in_executor(None, produce)
+        finished = False
+        
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    finished = True
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            if not finished:
+                token.cancel('closed')
+            await producer
+    
+    def _process_instance_worker(self, instance: WindowsInstance,
+                                 token: CancellationToken) -> ExtractionResult:
+        """Processa uma instância numa thread do pool (com cProfile por thread)"""
+        with self._cpu_profile(), self._using_token(token):
+            return self.process_instance(instance)
+    
+    def _iter_sequential(self, instances: List[WindowsInstance],
+                         token: CancellationToken) -> Iterator[ExtractionResult]:
         """Processa instâncias sequencialmente"""
         self.logger.info("Processamento sequencial...")
         
         for i, instance in enumerate(instances, 1):
-            self.logger.info(f"--- Instância {i}/{len(instances)} ---")
-            self.process_instance(instance)
-            print()  # Linha em branco para separar
+            if token.cancelled:
+                # Execução cancelada: as restantes são produzidas como não iniciadas
+                result = ExtractionResult(instance, 'not_started', error='Não iniciada')
+            else:
+                self.logger.info(f"--- Instância {i}/{len(instances)} ---")
+                try:
+                    with self._using_token(token):
+                        result = self.process_instance(instance)
+                except KeyboardInterrupt:
+                    self.stats['instances_cancelled'] += 1
+                    raise
+            
+            try:
+                yield result
+            except GeneratorExit:
+                token.cancel('closed')
+                raise
     
-    def _process_instances_concurrent(self, instances: List[WindowsInstance]):
+    def _iter_concurrent(self, instances: List[WindowsInstance],
+                         token: CancellationToken) -> Iterator[ExtractionResult]:
         """Processa instâncias concorrentemente"""
         self.logger.info(f"Processamento concorrente ({self.concurrent_operations} threads)...")
         
-        with ThreadPoolExecutor(max_workers=self.concurrent_operations) as executor:
+        with ThreadPoolExecutor(max_workers=self.concurrent_operations,
+                                thread_name_prefix='extractor') as executor:
             # Submeter tarefas
             future_to_instance = {
-                executor.submit(self.process_instance, instance): instance 
+                executor.submit(self._process_instance_worker, instance, token): instance 
                 for instance in instances
             }
             
             # Aguardar conclusão
-            for future in as_completed(future_to_instance):
-                instance = future_to_instance[future]
-                try:
-                    success = future.result()
-                    status = "✅ Sucesso" if success else "❌ Falha"
-                    self.logger.info(f"{status}: {instance.name}")
-                except Exception as e:
-                    self.logger.error(f"❌ Exceção ao processar {instance.name}: {e}")
+            done = set()
+            try:
+                yield from self._completed_results(future_to_instance, done)
+            except GeneratorExit:
+                # Sinalizar os workers antes de aguardá-los no shutdown do pool
+                token.cancel('closed')
+                for pending in future_to_instance:
+                    pending.cancel()
+                raise
+            except KeyboardInterrupt:
+                self.logger.warning("⚠️ Interrupção recebida - cancelando comandos em andamento")
+                token.cancel('interrupt')
+                for pending in future_to_instance:
+                    pending.cancel()
+                
+                # Instâncias em andamento terminam como 'cancelled' com os arquivos parciais
+                remaining = {future: instance for future, instance in future_to_instance.items()
+                             if future not in done}
+                yield from self._completed_results(remaining, done)
+    
+    def _completed_results(self, future_to_instance: Dict[Any, WindowsInstance],
+                           done: set) -> Iterator[ExtractionResult]:
+        """Produz os resultados à medida que os futures terminam (cancelados = não iniciados)"""
+        for future in as_completed(future_to_instance):
+            done.add(future)
+            instance = future_to_instance[future]
+            
+            if future.cancelled():
+                yield ExtractionResult(instance, 'not_started', error='Não iniciada')
+                continue
+            
+            try:
+                result = future.result()
+            except Exception as e:
+                self.logger.error(f"❌ Exceção ao processar {instance.name}: {e}")
+                result = ExtractionResult(instance, 'failed', error=str(e))
+            yield result
     
     def _generate_final_report(self):
         """Gera relatório final"""
@@ -482,8 +2361,18 @@ class AppSettingsExtractor:
         self.logger.info(f"Instâncias processadas: {self.stats['instances_processed']}")
         self.logger.info(f"Instâncias com sucesso: {self.stats['instances_successful']}")
         self.logger.info(f"Total de arquivos extraídos: {self.stats['files_extracted']}")
+        if self.validate:
+            self.logger.info(f"Arquivos inválidos/truncados: {self.stats['files_invalid']}")
         self.logger.info(f"Diretório de backup: {self.backup_dir}")
         
+        if self.cancel_token.cancelled:
+            not_started = self.stats['instances_found'] - self.stats['instances_processed']
+            self.stats['instances_not_started'] = not_started
+            self.logger.warning(f"⏹️ Execução interrompida ({self.cancel_token.reason}) - relatório parcial")
+            self.logger.warning(f"Instâncias interrompidas: {self.stats['instances_cancelled']}")
+            self.logger.warning(f"Instâncias não iniciadas: {not_started}")
+            self.logger.warning(f"Comandos SSM cancelados: {self.stats['commands_cancelled']}")
+        
         if self.stats['errors']:
             self.logger.warning(f"Erros encontrados: {len(self.stats['errors'])}")
             for error in self.stats['errors']:
@@ -493,7 +2382,8 @@ class AppSettingsExtractor:
         if self.stats['instances_successful'] > 0:
             self.logger.info("\n📁 Arquivos extraídos:")
             json_files = list(self.backup_dir.rglob("*.json"))
-            json_files = [f for f in json_files if f.name != 'metadata.json']
+            json_files = [f for f in json_files if not _is_report_file(f)
+                          and CANONICAL_DIR not in f.relative_to(self.backup_dir).parts]
             
             for file_path in sorted(json_files):
                 relative_path = file_path.relative_to(self.backup_dir)
@@ -509,6 +2399,282 @@ class AppSettingsExtractor:
             self.logger.warning("⚠️ Extração concluída com algumas falhas")
         else:
             self.logger.error("❌ Extração falhou completamente")
+        
+        self._write_run_report()
+    
+    def _write_run_report(self):
+        """Salva o relatório da execução (completo ou parcial) em JSON"""
+        report = {
+            'status': 'partial' if self.cancel_token.cancelled else 'completed',
+            'cancel_reason': self.cancel_token.reason,
+            'deadline_seconds': self.deadline_seconds,
+            'target_path': None if self.discover_sites else self.target_path,
+            'discover_sites': self.discover_sites,
+            'shard_index': self.shard_index,
+            'shard_count': self.shard_count,
+            'report_date': datetime.now().isoformat(),
+            'stats': self.stats,
+            'instances': self.manifest
+        }
+        
+        report_path = self.backup_dir / 'run_report.json'
+        try:
+            self.backup_dir.mkdir(parents=True, exist_ok=True)
+            report_path.write_text(json.dumps(report, indent=2), encoding='utf-8')
+            self.logger.info(f"📄 Relatório salvo em: {report_path}")
+        except Exception as e:
+            self.logger.error(f"Erro ao salvar relatório: {e}")
+
+
+def _enable_debug_logging(extractor: AppSettingsExtractor):
+    """Ajusta o nível de log para DEBUG (--verbose)"""
+    extractor.logger.setLevel(logging.DEBUG)
+    for handler in extractor.logger.handlers:
+        handler.setLevel(logging.DEBUG)
+
+
+def _shard_file(path: Optional[str], index: int) -> Optional[str]:
+    """Nome de arquivo por shard (ex: trace.json -> trace_shard003.json)"""
+    if not path:
+        return path
+    file_path = Path(path)
+    return str(file_path.with_name(f'{file_path.stem}_shard{index:03d}{file_path.suffix}'))
+
+
+FLEET_FILE = 'fleet.json'
+
+
+def load_fleet(extractor_kwargs: Dict[str, Any], shared_dir: Path) -> List[WindowsInstance]:
+    """
+    Frota compartilhada pelos shards, listada uma única vez em <shared_dir>/fleet.json
+    
+    O primeiro runner a listar grava o arquivo (link atômico); os demais, inclusive em
+    outros hosts, reutilizam a mesma lista. Levanta ExtractorError se a busca falhar ou
+    se o arquivo existente foi listado com outro filtro de servidores.
+    """
+    fleet_path = shared_dir / FLEET_FILE
+    extractor = AppSettingsExtractor(**dict(extractor_kwargs, configure_logging=False))
+    
+    if not fleet_path.exists():
+        instances = extractor.describe_windows_instances()
+        
+        shared_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = shared_dir / f'{FLEET_FILE}.{socket.gethostname()}.{os.getpid()}.tmp'
+        tmp_path.write_text(json.dumps({
+            'listed_at': datetime.now().isoformat(),
+            'server_filter': extractor.server_filter,
+            'instances': [
+                {'instance_id': i.instance_id, 'name': i.name,
+                 'private_ip': i.private_ip, 'public_ip': i.public_ip}
+                for i in instances
+            ]
+        }, indent=2), encoding='utf-8')
+        
+        try:
+            os.link(str(tmp_path), str(fleet_path))
+        except FileExistsError:
+            pass  # Outro runner listou primeiro: usar a lista dele
+        finally:
+            ShardCoordinator._remove(tmp_path)
+    
+    data = json.loads(fleet_path.read_text(encoding='utf-8'))
+    
+    # Lista de outra execução (outro --filter) no mesmo diretório: não misturar as frotas
+    if data.get('server_filter') != extractor.server_filter:
+        raise ExtractorError(
+            f"{fleet_path} foi listado com o filtro '{data.get('server_filter')}', "
+            f"não '{extractor.server_filter}' - use outro --shared-dir"
+        )
+    return [WindowsInstance(**entry) for entry in data['instances']]
+
+
+def run_shard_worker(extractor_kwargs: Dict[str, Any], shared_dir: str, shard_count: int,
+                     verbose: bool = False,
+                     fleet: Optional[List[WindowsInstance]] = None) -> int:
+    """
+    Reivindica e processa shards até não restar nenhum livre
+    
+    Cada shard é salvo em <shared_dir>/shard-NNN com seu run_report.json.
+    Retorna o número de shards concluídos por este worker.
+    """
+    if fleet is None:
+        fleet = load_fleet(extractor_kwargs, Path(shared_dir))
+    
+    coordinator = ShardCoordinator(Path(shared_dir), shard_count)
+    deadline_seconds = extractor_kwargs.pop('deadline_seconds', None)
+    started = time.monotonic()
+    completed = 0
+    
+    while True:
+        remaining = None
+        if deadline_seconds:
+            remaining = deadline_seconds - (time.monotonic() - started)
+            if remaining <= 0:
+                break
+        
+        index = coordinator.claim()
+        if index is None:
+            break
+        
+        try:
+            with coordinator.heartbeat(index):
+                kwargs = dict(extractor_kwargs,
+                              trace_file=_shard_file(extractor_kwargs.get('trace_file'), index),
+                              cprofile_file=_shard_file(extractor_kwargs.get('cprofile_file'), index))
+                extractor = AppSettingsExtractor(
+                    **kwargs,
+                    deadline_seconds=remaining,
+                    backup_dir=str(coordinator.shard_dir(index)),
+                    shard_index=index,
+                    shard_count=shard_count
+                )
+                if verbose:
+                    _enable_debug_logging(extractor)
+                extractor.run(fleet)
+        except BaseException:
+            coordinator.release(index)
+            raise
+        
+        # Shard interrompido fica livre para ser refeito por outro worker
+        if extractor.cancel_token.cancelled:
+            coordinator.release(index)
+            break
+        
+        coordinator.complete(index)
+        completed += 1
+    
+    return completed
+
+
+def merge_shard_reports(shared_dir: Path, shard_count: Optional[int] = None) -> Dict[str, Any]:
+    """Combina os run_report.json dos shards num único relatório em <shared_dir>/run_report.json"""
+    reports = {}
+    for report_path in sorted(shared_dir.glob('shard-*/run_report.json')):
+        report = json.loads(report_path.read_text(encoding='utf-8'))
+        reports[report['shard_index']] = report
+    
+    if shard_count is None:
+        shard_count = max((r['shard_count'] for r in reports.values()), default=0)
+    
+    stats: Dict[str, Any] = {'errors': []}
+    instances = []
+    for index, report in sorted(reports.items()):
+        for key, value in report['stats'].items():
+            if key == 'errors':
+                stats['errors'].extend(value)
+            else:
+                stats[key] = stats.get(key, 0) + value
+        for entry in report.get('instances', []):
+            instances.append(dict(entry, shard_index=index))
+    
+    incomplete = [index for index in range(shard_count)
+                  if index not in reports
+                  or not (shared_dir / f'shard-{index:03d}.done').exists()]
+    
+    merged = {
+        'status': 'partial' if incomplete else 'completed',
+        'shard_count': shard_count,
+        'shards_incomplete': incomplete,
+        'report_date': datetime.now().isoformat(),
+        'stats': stats,
+        'instances': instances
+    }
+    
+    (shared_dir / 'run_report.json').write_text(json.dumps(merged, indent=2), encoding='utf-8')
+    return merged
+
+
+def _print_merge_summary(shared_dir: Path, merged: Dict[str, Any]):
+    """Resumo do relatório combinado dos shards"""
+    stats = merged['stats']
+    print("=" * 50)
+    print(f"📊 RELATÓRIO COMBINADO ({merged['shard_count']} shards)")
+    print("=" * 50)
+    print(f"Instâncias encontradas: {stats.get('instances_found', 0)}")
+    print(f"Instâncias com sucesso: {stats.get('instances_successful', 0)}")
+    print(f"Total de arquivos extraídos: {stats.get('files_extracted', 0)}")
+    print(f"Erros encontrados: {len(stats['errors'])}")
+    if merged['shards_incomplete']:
+        print(f"⚠️ Shards incompletos: {merged['shards_incomplete']}")
+    print(f"📄 Relatório salvo em: {shared_dir / 'run_report.json'}")
+
+
+def _print_validation_summary(report: Dict[str, Any]):
+    """Resumo da validação de um snapshot"""
+    summary = report['summary']
+    print(f"🔎 Validação de {report['files_total']} arquivos: {summary['valid']} válidos, "
+          f"{summary['invalid']} inválidos, {summary['truncated']} truncados")
+    print(f"   Conteúdos distintos: {report['unique_contents']}")
+    for name, info in report['files'].items():
+        if info['status'] != 'valid':
+            print(f"  ❌ {name}: {info['status']} - {info['error']}")
+    print(f"📄 Relatório salvo em: {Path(report['snapshot']) / 'validation_report.json'}")
+
+
+def run_sharded(extractor_kwargs: Dict[str, Any], shared_dir: str, shard_count: int,
+                workers: int = 1, verbose: bool = False) -> bool:
+    """
+    Executa os shards em `workers` processos locais e combina os relatórios
+    
+    Os relatórios só são combinados (e validados) quando todos os shards estão concluídos;
+    com vários hosts, o primeiro a encontrar todos concluídos consolida.
+    """
+    # --concurrent é o orçamento total do host, dividido entre os workers
+    concurrent = extractor_kwargs.get('concurrent_operations', 3)
+    if workers > concurrent:
+        print(f"⚠️ --workers {workers} > --concurrent {concurrent}: usando {concurrent} workers")
+        workers = max(1, concurrent)
+    per_worker = max(1, concurrent // workers)
+    extractor_kwargs = dict(extractor_kwargs, concurrent_operations=per_worker)
+    
+    # A validação roda uma vez sobre o diretório compartilhado, não por shard
+    validate = extractor_kwargs.pop('validate', False)
+    validate_workers = extractor_kwargs.pop('validate_workers', None)
+    
+    print(f"🧩 {shard_count} shards em {shared_dir} - {workers} workers x {per_worker} threads")
+    
+    # Frota listada uma vez (e não uma vez por shard); sem ela nenhum shard é reivindicado
+    try:
+        fleet = load_fleet(extractor_kwargs, Path(shared_dir))
+    except ExtractorError as e:
+        print(f"❌ {e} - nenhum shard processado")
+        return False
+    print(f"📋 Frota: {len(fleet)} instâncias ({Path(shared_dir) / FLEET_FILE})")
+    
+    worker_failed = False
+    if workers <= 1:
+        run_shard_worker(dict(extractor_kwargs), shared_dir, shard_count, verbose, fleet)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(run_shard_worker, dict(extractor_kwargs), shared_dir,
+                                shard_count, verbose, fleet)
+                for _ in range(workers)
+            ]
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"❌ Worker falhou: {e}")
+                    worker_failed = True
+    
+    # Outros hosts ainda processando: cada um consolidaria uma visão parcial do diretório
+    coordinator = ShardCoordinator(Path(shared_dir), shard_count)
+    pending = coordinator.pending()
+    if pending:
+        print(f"⏳ {len(pending)}/{shard_count} shards ainda não concluídos - "
+              f"rode --merge {shared_dir} quando todos terminarem")
+        return not worker_failed
+    if not coordinator.claim_merge():
+        print(f"ℹ️ {shared_dir} já foi consolidado por outro runner (rode --merge {shared_dir} para refazer)")
+        return not worker_failed
+    
+    merged = merge_shard_reports(Path(shared_dir), shard_count)
+    _print_merge_summary(Path(shared_dir), merged)
+    
+    if validate:
+        _print_validation_summary(validate_snapshot(Path(shared_dir), validate_workers))
+    return merged['stats'].get('instances_successful', 0) > 0
 
 
 def main():
@@ -522,6 +2688,14 @@ Exemplos de uso:
   %(prog)s --filter SI2 --target "D:\\Sites\\Api"
   %(prog)s --concurrent 5
   %(prog)s --profile meu-profile --filter WEB --target "C:\\Apps\\Config"
+  %(prog)s --profile meu-profile --trace --cprofile
+  %(prog)s --profile meu-profile --deadline 1800
+  %(prog)s --profile meu-profile --discover-sites
+  %(prog)s --profile meu-profile --shards 8 --workers 4 --shared-dir /mnt/extracao
+  %(prog)s --merge /mnt/extracao
+  %(prog)s --profile meu-profile --validate
+  %(prog)s --validate-only config_backups_20250815_143022
+  %(prog)s --profile meu-profile --restore config_backups_20250815_143022 --wave-size 100
         """
     )
     
@@ -556,29 +2730,203 @@ Exemplos de uso:
         help='Logging detalhado (DEBUG)'
     )
     
+    parser.add_argument(
+        '--discover-sites', '-s',
+        action='store_true',
+        help='Descobre os sites IIS de cada servidor e extrai os arquivos de todos '
+             '(ignora --target)'
+    )
+    
+    parser.add_argument(
+        '--inventory',
+        default='site_inventory.json',
+        metavar='ARQUIVO',
+        help='Cache dos sites IIS descobertos por instância (padrão: site_inventory.json)'
+    )
+    
+    parser.add_argument(
+        '--refresh-inventory',
+        action='store_true',
+        help='Ignora o inventário e refaz a descoberta de sites IIS'
+    )
+    
+    parser.add_argument(
+        '--deadline', '-d',
+        type=float,
+        metavar='SEGUNDOS',
+        help='Prazo total da execução; ao expirar, cancela comandos SSM em andamento '
+             'e gera relatório parcial'
+    )
+    
+    parser.add_argument(
+        '--ssm-document',
+        default=SSM_DOCUMENT_NAME,
+        metavar='NOME',
+        help=f'Nome do documento SSM registrado pelo extrator (padrão: {SSM_DOCUMENT_NAME})'
+    )
+    
+    parser.add_argument(
+        '--no-ssm-document',
+        action='store_true',
+        help='Não registra documento; envia PowerShell inline via AWS-RunPowerShellScript'
+    )
+    
+    parser.add_argument(
+        '--validate',
+        action='store_true',
+        help='Valida e canonicaliza os JSON extraídos (BOM, CRLF, truncamento) '
+             'num pool de processos'
+    )
+    
+    parser.add_argument(
+        '--validate-only',
+        metavar='DIR',
+        help='Apenas valida um snapshot existente (config_backups_*) e sai'
+    )
+    
+    parser.add_argument(
+        '--validate-workers',
+        type=int,
+        metavar='N',
+        help='Processos da validação (padrão: número de CPUs)'
+    )
+    
+    parser.add_argument(
+        '--restore',
+        metavar='SNAPSHOT',
+        help='Restaura os arquivos de um snapshot (config_backups_*) nas instâncias de origem'
+    )
+    
+    parser.add_argument(
+        '--wave-size',
+        type=int,
+        default=50,
+        help='Arquivos por onda do restore (padrão: 50)'
+    )
+    
+    parser.add_argument(
+        '--max-concurrency',
+        default='25%',
+        help='MaxConcurrency do SSM por comando de restore (padrão: 25%%)'
+    )
+    
+    parser.add_argument(
+        '--max-errors',
+        default='0',
+        help='MaxErrors do SSM por comando e orçamento de falhas por onda (padrão: 0)'
+    )
+    
+    parser.add_argument(
+        '--shards',
+        type=int,
+        metavar='N',
+        help='Divide as instâncias em N shards (hash do instance ID) coordenados '
+             'por leases em --shared-dir'
+    )
+    
+    parser.add_argument(
+        '--shared-dir',
+        metavar='DIR',
+        help='Diretório compartilhado entre workers/hosts '
+             '(padrão: config_backups_sharded_<timestamp>)'
+    )
+    
+    parser.add_argument(
+        '--workers', '-w',
+        type=int,
+        default=1,
+        help='Processos locais que reivindicam shards (padrão: 1)'
+    )
+    
+    parser.add_argument(
+        '--merge',
+        metavar='DIR',
+        help='Apenas combina os relatórios dos shards de DIR e sai'
+    )
+    
+    parser.add_argument(
+        '--trace',
+        nargs='?',
+        const='',
+        metavar='ARQUIVO',
+        help='Exporta spans por etapa no formato Chrome trace-event '
+             '(padrão: logs/trace_<timestamp>.json)'
+    )
+    
+    parser.add_argument(
+        '--cprofile',
+        nargs='?',
+        const='',
+        metavar='ARQUIVO',
+        help='Salva perfil de CPU local via cProfile/pstats '
+             '(padrão: logs/cprofile_<timestamp>.pstats)'
+    )
+    
     args = parser.parse_args()
     
+    # Arquivos padrão de profiling
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    if args.trace == '':
+        args.trace = f'logs/trace_{timestamp}.json'
+    if args.cprofile == '':
+        args.cprofile = f'logs/cprofile_{timestamp}.pstats'
+    
+    extractor_kwargs = dict(
+        aws_profile=args.profile,
+        server_filter=args.filter,
+        target_path=args.target,
+        concurrent_operations=args.concurrent,
+        trace_file=args.trace,
+        cprofile_file=args.cprofile,
+        deadline_seconds=args.deadline,
+        discover_sites=args.discover_sites,
+        inventory_file=args.inventory,
+        refresh_inventory=args.refresh_inventory,
+        ssm_document=None if args.no_ssm_document else args.ssm_document,
+        validate=args.validate,
+        validate_workers=args.validate_workers
+    )
+    
     try:
+        # Apenas combinar relatórios de shards
+        if args.merge:
+            merged = merge_shard_reports(Path(args.merge))
+            _print_merge_summary(Path(args.merge), merged)
+            sys.exit(0 if merged['stats'].get('instances_successful', 0) > 0 else 1)
+        
+        # Apenas validar um snapshot existente
+        if args.validate_only:
+            report = validate_snapshot(Path(args.validate_only), args.validate_workers)
+            _print_validation_summary(report)
+            summary = report['summary']
+            sys.exit(0 if summary['invalid'] + summary['truncated'] == 0 else 1)
+        
+        # Execução em shards (processos locais e/ou vários hosts)
+        if args.shards:
+            shared_dir = args.shared_dir or f'config_backups_sharded_{timestamp}'
+            success = run_sharded(extractor_kwargs, shared_dir, args.shards,
+                                  args.workers, args.verbose)
+            sys.exit(0 if success else 1)
+        
         # Criar extrator
-        extractor = AppSettingsExtractor(
-            aws_profile=args.profile,
-            server_filter=args.filter,
-            target_path=args.target,
-            concurrent_operations=args.concurrent
-        )
+        extractor = AppSettingsExtractor(**extractor_kwargs)
         
         # Ajustar nível de log se verbose
         if args.verbose:
-            extractor.logger.setLevel(logging.DEBUG)
-            for handler in extractor.logger.handlers:
-                handler.setLevel(logging.DEBUG)
+            _enable_debug_logging(extractor)
         
-        # Executar extração
-        success = extractor.run()
+        # Restaurar snapshot ou executar extração
+        if args.restore:
+            success = extractor.restore_snapshot(Path(args.restore), args.wave_size,
+                                                 args.max_concurrency, args.max_errors)
+        else:
+            success = extractor.run()
         
         # Exit code
         sys.exit(0 if success else 1)
         
+    except AwsCredentialsError:
+        sys.exit(1)
     except KeyboardInterrupt:
         print("\n❌ Operação cancelada pelo usuário")
         sys.exit(1)
@@ -0,0 +1,119 @@
+# Verificação local de extractor_remote.ps1 sobre ssm_document/fixtures (sem SSM/AWS)
+#
+#   pwsh -File check_extractor_remote.ps1
+#   powershell.exe -ExecutionPolicy Bypass -File check_extractor_remote.ps1   # Windows PowerShell 5.1
+#
+# Exit code 0 quando todas as verificações passam.
+
+$ErrorActionPreference = 'Stop'
+$remote = Join-Path $PSScriptRoot 'extractor_remote.ps1'
+$fixtures = Join-Path $PSScriptRoot 'fixtures'
+$failures = 0
+
+# Hostname fixo para expandir appsettings.{hostname}.json nas fixtures
+$env:COMPUTERNAME = 'FIXTUREHOST'
+
+function Check([bool] $condition, [string] $message) {
+    if ($condition) {
+        Write-Host "OK     $message"
+    } else {
+        Write-Host "FALHA  $message"
+        $script:failures++
+    }
+}
+
+function Invoke-Remote([hashtable] $arguments) {
+    $output = & $remote @arguments
+    return ($output -join "`n") | ConvertFrom-Json
+}
+
+function Read-RemoteFile([string] $path) {
+    # Junta as páginas de read-file e descomprime, como o extract_appsettings.py
+    $pages = @()
+    $chunks = 1
+    $sha = $null
+    while ($pages.Count -lt $chunks) {
+        $page = Invoke-Remote @{ Mode = 'read-file'; Path = $path; Chunk = $pages.Count }
+        $chunks = $page.chunks
+        $sha = $page.sha256
+        $pages += [string] $page.data
+    }
+
+    $compressed = New-Object IO.MemoryStream(, [Convert]::FromBase64String($pages -join ''))
+    $gzip = New-Object IO.Compression.GZipStream($compressed, [IO.Compression.CompressionMode]::Decompress)
+    $buffer = New-Object IO.MemoryStream
+    $gzip.CopyTo($buffer)
+    $gzip.Dispose()
+
+    return [PSCustomObject]@{ bytes = $buffer.ToArray(); sha256 = $sha; chunks = $chunks }
+}
+
+function Get-Sha256([byte[]] $bytes) {
+    return [BitConverter]::ToString([Security.Cryptography.SHA256]::Create().ComputeHash($bytes)).Replace('-', '').ToLower()
+}
+
+$work = Join-Path ([IO.Path]::GetTempPath()) ("extractor-check-" + [Guid]::NewGuid())
+New-Item -ItemType Directory -Path $work | Out-Null
+
+try {
+    # get-content: lista arquivos e tamanhos (sem conteúdo)
+    $listing = Invoke-Remote @{ Mode = 'get-content'; Path = $fixtures; Patterns = 'appsettings.json,appsettings.{hostname}.json,appsettings.Missing.json' }
+    $expected = (Get-Item -LiteralPath (Join-Path $fixtures 'appsettings.json')).Length
+    Check ($listing.hostname -eq 'FIXTUREHOST') 'get-content: hostname'
+    Check ($listing.exists -eq $true) 'get-content: diretório existe'
+    Check ($listing.files.'appsettings.json' -eq $expected) 'get-content: tamanho de appsettings.json'
+    Check ($null -ne $listing.files.'appsettings.FIXTUREHOST.json') 'get-content: {hostname} expandido'
+    Check ($null -eq $listing.files.'appsettings.Missing.json') 'get-content: arquivo ausente = null'
+
+    $missing = Invoke-Remote @{ Mode = 'get-content'; Path = (Join-Path $work 'nao-existe') }
+    Check ($missing.exists -eq $false) 'get-content: diretório inexistente'
+
+    # read-file: bytes exatos (BOM, CRLF, acentos) e sha256
+    foreach ($name in 'appsettings.json', 'appsettings.FIXTUREHOST.json') {
+        $path = Join-Path $fixtures $name
+        $original = [IO.File]::ReadAllBytes($path)
+        $read = Read-RemoteFile $path
+        Check ((Get-Sha256 $read.bytes) -eq (Get-Sha256 $original)) "read-file: bytes de $name"
+        Check ($read.sha256 -eq (Get-Sha256 $original)) "read-file: sha256 de $name"
+    }
+
+    # read-file: arquivo maior que uma página (conteúdo pouco compressível)
+    $large = Join-Path $work 'appsettings.json'
+    $random = New-Object byte[] 60000
+    (New-Object Random 42).NextBytes($random)
+    [IO.File]::WriteAllText($large, '{"blob": "' + [Convert]::ToBase64String($random) + '"}')
+    $read = Read-RemoteFile $large
+    Check ($read.chunks -gt 1) "read-file: paginado ($($read.chunks) páginas)"
+    Check ((Get-Sha256 $read.bytes) -eq (Get-Sha256 ([IO.File]::ReadAllBytes($large)))) 'read-file: páginas recombinadas'
+
+    $output = & $remote -Mode read-file -Path $large -Chunk 0
+    Check (($output -join '').Length -lt 24000) 'read-file: página dentro do limite do SSM'
+
+    # put-content: grava, guarda .pre-restore e confere o hash
+    $target = Join-Path $work 'restore.json'
+    [IO.File]::WriteAllText($target, '{"old": true}')
+    $new = [IO.File]::ReadAllBytes((Join-Path $fixtures 'appsettings.FIXTUREHOST.json'))
+    $buffer = New-Object IO.MemoryStream
+    $gzip = New-Object IO.Compression.GZipStream($buffer, [IO.Compression.CompressionMode]::Compress)
+    $gzip.Write($new, 0, $new.Length)
+    $gzip.Dispose()
+    $payload = [Convert]::ToBase64String($buffer.ToArray())
+
+    $written = Invoke-Remote @{ Mode = 'put-content'; Path = $target; Content = $payload; Sha256 = (Get-Sha256 $new) }
+    Check ($written.ok -eq $true) 'put-content: hash conferido'
+    Check ((Get-Sha256 ([IO.File]::ReadAllBytes($target))) -eq (Get-Sha256 $new)) 'put-content: conteúdo gravado'
+    Check ([IO.File]::ReadAllText("$target.pre-restore") -eq '{"old": true}') 'put-content: .pre-restore'
+
+    $global:LASTEXITCODE = 0
+    $written = Invoke-Remote @{ Mode = 'put-content'; Path = $target; Content = $payload; Sha256 = ('0' * 64) }
+    Check ($written.ok -eq $false -and $LASTEXITCODE -eq 1) 'put-content: hash divergente = exit 1'
+}
+finally {
+    Remove-Item -LiteralPath $work -Recurse -Force
+}
+
+if ($failures) {
+    Write-Host "$failures verificações falharam"
+    exit 1
+}
+Write-Host 'Todas as verificações passaram'
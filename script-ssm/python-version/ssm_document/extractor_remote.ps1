@@ -0,0 +1,114 @@
+# Lógica remota do extrator de appsettings.json
+# Registrada pelo extract_appsettings.py como documento SSM (AppSettingsExtractor-Remote).
+#
+# Compatível com Windows PowerShell 5.1 (o que o SSM Agent executa) e pwsh.
+# A saída de cada invocação cabe no limite de 24000 caracteres do SSM: get-content só
+# lista os arquivos e read-file devolve um arquivo por vez, paginado.
+#
+# Teste local (sem SSM), sobre ssm_document/fixtures:
+#   pwsh -File check_extractor_remote.ps1
+#   pwsh -File extractor_remote.ps1 -Mode get-content -Path ./fixtures -Patterns 'appsettings.json,appsettings.{hostname}.json'
+#   pwsh -File extractor_remote.ps1 -Mode read-file -Path ./fixtures/appsettings.json -Chunk 0
+#   pwsh -File extractor_remote.ps1 -Mode discover-sites   # requer IIS (WebAdministration)
+
+param(
+    [ValidateSet('discover-sites', 'get-content', 'read-file', 'put-content')]
+    [string] $Mode = 'get-content',
+    [string] $Path = '',
+    [string] $Patterns = 'appsettings.json',
+    [string] $Content = '',
+    [string] $Sha256 = '',
+    [int] $Chunk = 0
+)
+
+# Caracteres de dados por página de read-file (o restante do limite fica para o JSON)
+$PageSize = 20000
+
+$ErrorActionPreference = 'Stop'
+$hostname = if ($env:COMPUTERNAME) { $env:COMPUTERNAME } else { [Environment]::MachineName }
+
+switch ($Mode) {
+    'discover-sites' {
+        # Sites IIS e caminhos físicos
+        Import-Module WebAdministration
+        $sites = @(Get-Website | ForEach-Object {
+            [PSCustomObject]@{
+                name = $_.Name
+                path = [Environment]::ExpandEnvironmentVariables($_.PhysicalPath)
+            }
+        })
+        [PSCustomObject]@{ hostname = $hostname; sites = $sites } | ConvertTo-Json -Compress -Depth 3
+    }
+    'get-content' {
+        # Arquivos do diretório e seus tamanhos ({hostname} é expandido em cada padrão);
+        # o conteúdo de cada um é lido depois com read-file
+        $exists = Test-Path -LiteralPath $Path -PathType Container
+        $files = [ordered]@{}
+        if ($exists) {
+            foreach ($pattern in ($Patterns -split ',')) {
+                $name = $pattern.Trim().Replace('{hostname}', $hostname)
+                if (-not $name) { continue }
+                $file = Join-Path $Path $name
+                if (Test-Path -LiteralPath $file -PathType Leaf) {
+                    $files[$name] = [long] (Get-Item -LiteralPath $file).Length
+                } else {
+                    $files[$name] = $null
+                }
+            }
+        }
+        [PSCustomObject]@{ hostname = $hostname; exists = $exists; files = $files } | ConvertTo-Json -Compress -Depth 3
+    }
+    'read-file' {
+        # Bytes do arquivo ($Path = caminho completo) em gzip+base64, página $Chunk
+        $bytes = [IO.File]::ReadAllBytes($Path)
+        $buffer = New-Object IO.MemoryStream
+        $gzip = New-Object IO.Compression.GZipStream($buffer, [IO.Compression.CompressionMode]::Compress)
+        $gzip.Write($bytes, 0, $bytes.Length)
+        $gzip.Dispose()
+
+        [string] $encoded = [Convert]::ToBase64String($buffer.ToArray())
+        $chunks = [Math]::Max(1, [int] [Math]::Ceiling($encoded.Length / $PageSize))
+        if ($Chunk -lt 0 -or $Chunk -ge $chunks) {
+            throw "Página $Chunk inexistente ($chunks páginas)"
+        }
+        $start = $Chunk * $PageSize
+        [string] $data = $encoded.Substring($start, [Math]::Min($PageSize, $encoded.Length - $start))
+
+        $sha = [BitConverter]::ToString([Security.Cryptography.SHA256]::Create().ComputeHash($bytes)).Replace('-', '').ToLower()
+        [PSCustomObject]@{
+            hostname = $hostname
+            path     = $Path
+            size     = $bytes.Length
+            sha256   = $sha
+            chunk    = $Chunk
+            chunks   = $chunks
+            data     = $data
+        } | ConvertTo-Json -Compress
+    }
+    'put-content' {
+        # Restaura um arquivo ($Path = caminho completo) a partir do conteúdo gzip+base64
+        $directory = Split-Path -Parent $Path
+        if (-not (Test-Path -LiteralPath $directory -PathType Container)) {
+            throw "Diretório não encontrado: $directory"
+        }
+
+        $compressed = New-Object IO.MemoryStream(, [Convert]::FromBase64String($Content))
+        $gzip = New-Object IO.Compression.GZipStream($compressed, [IO.Compression.CompressionMode]::Decompress)
+        $buffer = New-Object IO.MemoryStream
+        $gzip.CopyTo($buffer)
+        $gzip.Dispose()
+
+        # Guarda a versão atual e troca o arquivo de forma atômica
+        if (Test-Path -LiteralPath $Path -PathType Leaf) {
+            Copy-Item -LiteralPath $Path -Destination "$Path.pre-restore" -Force
+        }
+        $temp = "$Path.restore-tmp"
+        [IO.File]::WriteAllBytes($temp, $buffer.ToArray())
+        Move-Item -LiteralPath $temp -Destination $Path -Force
+
+        $actual = (Get-FileHash -LiteralPath $Path -Algorithm SHA256).Hash.ToLower()
+        $ok = $actual -eq $Sha256.ToLower()
+        [PSCustomObject]@{ hostname = $hostname; path = $Path; sha256 = $actual; ok = $ok } | ConvertTo-Json -Compress
+        if (-not $ok) { exit 1 }
+    }
+}
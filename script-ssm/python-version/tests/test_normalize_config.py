@@ -0,0 +1,102 @@
+"""Testes de normalize_config (validação e forma canônica dos appsettings)
+
+    cd script-ssm/python-version
+    python -m pytest -q tests
+"""
+
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from extract_appsettings import normalize_config  # noqa: E402
+
+
+def test_valid_file_is_canonicalized():
+    info = normalize_config(b'{"b": 1, "a": {"d": 2, "c": 3}}')
+
+    assert info['status'] == 'valid'
+    assert info['canonical'] == json.dumps({'a': {'c': 3, 'd': 2}, 'b': 1},
+                                           indent=2, sort_keys=True) + '\n'
+
+
+def test_equivalent_files_have_same_sha256():
+    lf = normalize_config(b'{"a": 1,\n "b": "Regi\xc3\xa3o"}\n')
+    crlf_bom = normalize_config(b'\xef\xbb\xbf{"b": "Regi\xc3\xa3o",\r\n  "a": 1}  \r\n')
+
+    assert lf['sha256'] == crlf_bom['sha256']
+    assert crlf_bom['bom'] and crlf_bom['crlf'] and crlf_bom['trailing_whitespace']
+    assert not lf['bom'] and not lf['crlf']
+
+
+def test_utf16_and_cp1252_are_decoded():
+    utf16 = normalize_config('\ufeff{"a": "Região"}'.encode('utf-16-le'))
+    cp1252 = normalize_config('{"a": "Região"}'.encode('cp1252'))
+
+    assert utf16['encoding'] == 'utf-16-le' and utf16['bom']
+    assert cp1252['encoding'] == 'cp1252'
+    assert utf16['sha256'] == cp1252['sha256']
+
+
+def test_comments_and_trailing_commas_are_accepted():
+    info = normalize_config(b'{\n  // comentario\n  "a": 1, /* bloco */\n  "b": [1, 2,],\n}')
+
+    assert info['status'] == 'valid'
+    assert info['comments']
+    assert json.loads(info['canonical']) == {'a': 1, 'b': [1, 2]}
+
+
+def test_trailing_comma_followed_by_comment():
+    info = normalize_config(b'{\n  "a": 1, // ultima chave\n}\n')
+
+    assert info['status'] == 'valid'
+    assert json.loads(info['canonical']) == {'a': 1}
+
+
+def test_comment_markers_inside_strings_are_kept():
+    info = normalize_config(b'{"url": "http://host/*x*/", "v": "a,}"}')
+
+    assert info['status'] == 'valid'
+    assert not info['comments']
+    assert json.loads(info['canonical']) == {'url': 'http://host/*x*/', 'v': 'a,}'}
+
+
+def test_duplicate_keys_are_reported():
+    info = normalize_config(b'{"a": 1, "a": 2, "b": {"c": 1, "c": 1}}')
+
+    assert info['status'] == 'valid'
+    assert sorted(info['duplicate_keys']) == ['a', 'c']
+
+
+def test_truncated_file():
+    info = normalize_config(b'{"a": [1, 2')
+
+    assert info['status'] == 'truncated'
+    assert info['canonical'] is None and info['sha256'] is None
+
+
+def test_truncated_file_with_comments():
+    # Posição do erro comparada com o texto sem comentários, que foi o analisado
+    info = normalize_config(b'{\n  // comentario\n  "a": 1, /* bloco\n longo */ "b": [1,')
+
+    assert info['status'] == 'truncated'
+
+
+def test_truncated_inside_block_comment():
+    info = normalize_config(b'{"a": 1 /* comentario sem fim')
+
+    assert info['status'] == 'truncated'
+
+
+def test_invalid_file_reports_position_of_parsed_text():
+    info = normalize_config(b'{\n  /* um\n  dois */\n  "a": 1,\n  "b": x\n}')
+
+    assert info['status'] == 'invalid'
+    assert 'linha 5' in info['error']
+
+
+def test_large_invalid_file_is_not_truncated():
+    raw = b'{"a": "' + b'x' * 30000 + b'", oops}'
+
+    assert normalize_config(raw)['status'] == 'invalid'